@@ -21,6 +21,8 @@ def main(argv: Optional[List[str]] = None):
         from autograder import __version__
 
         print(__version__)
+    elif args.command == "bench":
+        _run_benchmark(args)
     # the interface architecture needs to be refactored a bit. For now, this hack with hasattr
     # will prevent errors if autograder has been called on its own.
     elif not hasattr(args, "submission_path"):
@@ -43,6 +45,7 @@ def _create_parser():
     _create_stats_parser(subparsers)
     _create_guide_parser(subparsers)
     _create_plagiarism_parser(subparsers)
+    _create_bench_parser(subparsers)
     return parser
 
 
@@ -50,6 +53,27 @@ def _create_run_parser(subparsers):
     parser = subparsers.add_parser("run", help="Grade submissions in submission path or in current directory")
     parser.add_argument("-j", "--json", action="store_true", help="Output grades in json format")
     parser.add_argument("-v", "--verbose", action="store_true", help="Show all debugging output")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the results of previous runs")
+    parser.add_argument(
+        "--executor",
+        default="async",
+        choices=["async", "process"],
+        help="Grade submissions in a single event loop (async) or shard them across worker processes (process)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Number of worker processes for the process executor (defaults to the number of cores)",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=None,
+        metavar="out.json",
+        help="Save the timings of grading phases as a Chrome trace and print their summary to stderr",
+    )
     _add_submission_path_argument(parser)
     _add_submission_list_argument(parser)
 
@@ -86,10 +110,101 @@ def _create_guide_parser(subparsers):
 
 def _create_plagiarism_parser(subparsers):
     parser = subparsers.add_parser("plagiarism", help="Checks how similar the submissions are to each other")
+    parser.add_argument(
+        "--band",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Only align tokens that are at most N tokens away from the diagonal. Faster on long files (0 = disabled)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Number of processes and threads used to check submissions (defaults to the number of cores)",
+    )
+    parser.add_argument(
+        "--min-overlap",
+        type=float,
+        default=0.0,
+        metavar="F",
+        help="Only compare the submissions whose fingerprints overlap by at least F (from 0 to 1)",
+    )
+    parser.add_argument(
+        "--top-overlap",
+        type=int,
+        default=0,
+        metavar="K",
+        help="Only compare each submission to the K submissions whose fingerprints overlap with it the most",
+    )
+    parser.add_argument("--top", type=int, default=0, metavar="K", help="Only output the K most similar pairs")
+    parser.add_argument(
+        "--min-score",
+        type=float,
+        default=0.0,
+        metavar="X",
+        help="Only output the pairs whose similarity score is at least X",
+    )
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Output every pair as a separate line of json as soon as it is found (sorted only with --top)",
+    )
+    parser.add_argument(
+        "--corpus",
+        type=Path,
+        default=None,
+        metavar="DIR",
+        help="Also compare the submissions to the submissions from previous semesters stored in DIR",
+    )
+    parser.add_argument(
+        "--add-to-corpus",
+        action="store_true",
+        help="Store the submissions in the corpus after the comparison (requires --corpus)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Lex all submissions instead of reusing tokens from previous runs"
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Only compare the first N tokens of every submission (0 = no limit)",
+    )
     _add_submission_path_argument(parser)
     _add_submission_list_argument(parser)
 
 
+def _create_bench_parser(subparsers):
+    parser = subparsers.add_parser(
+        "bench", help="Measure grading speed on synthetic submissions generated from testcase templates"
+    )
+    parser.add_argument(
+        "-l",
+        "--language",
+        nargs="*",
+        default=None,
+        choices=[name for name in guide._get_supported_languages().keys()],
+        help="Programming languages to benchmark (defaults to all installed languages)",
+    )
+    parser.add_argument("-n", "--submissions", type=int, default=50, help="Number of submissions per language")
+    parser.add_argument("-m", "--testcases", type=int, default=4, help="Number of testcases per language")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Number of times to grade each language")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Override a [CONFIG] field for the benchmark. For example: --set MAX_CONCURRENT_SUBMISSIONS=8",
+    )
+    parser.add_argument("--cache", action="store_true", help="Reuse the caches between repeats")
+    parser.add_argument("--executor", default="async", choices=["async", "process"], help="See 'autograder run -h'")
+    parser.add_argument("--workers", type=int, default=None, metavar="N", help="See 'autograder run -h'")
+
+
 def _add_submission_path_argument(parser: argparse.ArgumentParser):
     parser.add_argument(
         "submission_path",
@@ -122,21 +237,69 @@ def _evaluate_args(args: argparse.Namespace, current_dir: Path):
         if args.verbose:
             L.setLevel(logging.DEBUG)
         submissions = [s.name for s in args.submissions] if args.submissions else args.submissions
-        return Grader(current_dir, args.json, submissions).run()
+        if args.trace is None:
+            return Grader(current_dir, args.json, submissions, not args.no_cache, args.executor, args.workers).run()
+        from autograder.tracing import tracer
+
+        tracer.enabled = True
+        try:
+            return Grader(current_dir, args.json, submissions, not args.no_cache, args.executor, args.workers).run()
+        finally:
+            tracer.save_chrome_trace(args.trace)
+            print(tracer.format_summary(), file=sys.stderr)
+            tracer.enabled = False
+            tracer.reset()
     elif args.command == "plagiarism":
         import json
 
         from . import plagiarism_detection
+        from .plagiarism_detection.corpus import Corpus
+        from .plagiarism_detection.token_cache import get_token_cache
+        from .testcase_utils.stdout_testcase import is_multifile_submission
+        from .util import AutograderError
 
-        files = [f for f in current_dir.iterdir() if f.is_file() and not f.suffix.endswith(".txt")]
+        if args.add_to_corpus and args.corpus is None:
+            raise AutograderError("--add-to-corpus requires --corpus")
+        corpus = Corpus(Path.cwd() / args.corpus) if args.corpus is not None else None
+        files = [
+            f
+            for f in current_dir.iterdir()
+            if (f.is_file() and not f.suffix.endswith(".txt")) or is_multifile_submission(f, [])
+        ]
         if args.submissions is not None:
             submissions = [submission.name for submission in args.submissions]
             files = [f for f in files if f.name in submissions]
-        result = plagiarism_detection.compare(files)
-        result = {tuple(k): v for k, v in result[list(result.keys())[0]].items()}
-        output = [{"student1": k[0].name, "student2": k[1].name, "similarity_score": v} for k, v in result.items()]
-        output.sort(key=lambda v: v["similarity_score"], reverse=True)
-        print(json.dumps({"results": output}, indent=4))
+        matches = plagiarism_detection.iterate_matches(
+            files,
+            band=args.band,
+            jobs=args.jobs,
+            min_overlap=args.min_overlap,
+            top_overlap=args.top_overlap,
+            corpus=corpus,
+            add_to_corpus=args.add_to_corpus,
+            token_cache=None if args.no_cache else get_token_cache(),
+            max_tokens=args.max_tokens,
+            top=args.top,
+            min_score=args.min_score,
+        )
+
+        def format_match(language: str, pair: frozenset, match: "plagiarism_detection.Match") -> dict:
+            entry = {}
+            for k, p in enumerate(pair, start=1):
+                # Submissions from the corpus are shown along with the name of the directory they came from
+                entry[f"student{k}"] = p.name if p.parent == current_dir else str(p)
+                if p in match.files:
+                    entry[f"student{k}_file"] = match.files[p].relative_to(p).as_posix()
+            return {**entry, "similarity_score": match.score, "language": language}
+
+        if args.jsonl:
+            # Matches are printed as they come so that the output never has to be kept in memory
+            for language, pair, match in matches:
+                print(json.dumps(format_match(language, pair, match)), flush=True)
+        else:
+            output = [format_match(*m) for m in matches]
+            output.sort(key=lambda v: v["similarity_score"], reverse=True)
+            print(json.dumps({"results": output}, indent=4))
     else:
         raise NotImplementedError(
             f"Unknown command '{args.command}' supplied.\nTry 'autograder --help for more information'"
@@ -144,5 +307,35 @@ def _evaluate_args(args: argparse.Namespace, current_dir: Path):
     return -1
 
 
+def _run_benchmark(args: argparse.Namespace):
+    import tomlkit
+
+    from autograder.benchmark import run_benchmark
+
+    config = {}
+    for override in args.set:
+        key, _, value = override.partition("=")
+        try:
+            config[key.strip()] = tomlkit.value(value)
+        except ValueError:
+            # Allows passing unquoted strings
+            config[key.strip()] = value
+    languages = guide._get_supported_languages()
+    names = args.language or [name for name, t in languages.items() if t.is_installed()]
+    for name in names:
+        result = run_benchmark(
+            languages[name],
+            name,
+            args.submissions,
+            args.testcases,
+            args.repeat,
+            config,
+            args.cache,
+            args.executor,
+            args.workers,
+        )
+        print(result.format() + "\n")
+
+
 if __name__ == "__main__":
     main()
@@ -1,24 +1,41 @@
 import asyncio
 import itertools
 import logging
+import os
 import shutil
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Callable, Dict, List, Optional, Set, Tuple, Type, Union, cast
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Type, TypeVar, Union, cast
 
 from .config_manager import GradingConfig
+from .grading_manifest import (
+    MANIFEST_FILE_NAME,
+    GradingManifest,
+    get_submission_fingerprint,
+    get_testcase_fingerprint,
+)
 from .output_summary import GradingOutputLogger, JsonGradingOutputLogger
-from .testcase_utils.abstract_testcase import TestCase
+from .testcase_utils.abstract_testcase import TestCase, TestCaseResult
+from .testcase_utils.performance import get_performance_grading
+from .testcase_utils.resource_limits import get_resource_limits
+from .testcase_utils.scheduler import Scheduler
 from .testcase_utils.shell import ShellError
-from .testcase_utils.stdout_testcase import StdoutOnlyTestCase
-from .testcase_utils.submission import Submission, find_appropriate_source_file_stem
+from .testcase_utils.stdout_testcase import PathWithStdoutOnlyInfo, StdoutOnlyTestCase
+from .testcase_utils.submission import Submission, SubmissionResults, find_appropriate_source_file_stem
 from .testcase_utils.testcase_io import EMPTY_TESTCASE_IO, TestCaseIO
 from .testcase_utils.testcase_picker import TestCasePicker
+from .tracing import Span, tracer
 from .util import AutograderError, get_file_names, hide_path_to_directory, import_from_path
 
 L = logging.getLogger("AUTOGRADER.grader")
+T = TypeVar("T")
+
+SHARDS_PER_WORKER = 4
+# Directories of concurrently running testcases within the student directory start with this prefix
+TESTCASE_DIR_PREFIX = ".testcase_"
 
 
 # TODO: What if grader built a less complex object whose only purpose is actually grading? Should improve complexity.
@@ -33,15 +50,30 @@ class Grader:
 
     logger: GradingOutputLogger
     config: GradingConfig
+    manifest: GradingManifest
+    submission_fingerprints: Dict[str, str]
+    testcase_fingerprints: Dict[str, str]
     testcase_picker: TestCasePicker
     extra_testcase_types: List[Type[TestCase]]
 
-    def __init__(self, current_dir: Path, json_output: bool = False, submissions: Optional[List[str]] = None) -> None:
+    def __init__(
+        self,
+        current_dir: Path,
+        json_output: bool = False,
+        submissions: Optional[List[str]] = None,
+        use_cache: bool = True,
+        executor: str = "async",
+        workers: Optional[int] = None,
+    ) -> None:
         self.json_output = json_output
+        self.executor = executor
+        self.workers = workers or os.cpu_count() or 1
         self.raw_submissions = submissions
         self.stdout_formatters = {}
         self.paths = AutograderPaths(current_dir)
         self.config = GradingConfig(self.paths.config, self.paths.default_config)
+        if not use_cache:
+            self.config.disable_cache()
         self.testcase_picker = TestCasePicker(self.paths.testcase_types_dir)
         self.stdout_formatters = self._import_formatters(self.paths.stdout_formatters)
         logger_type = JsonGradingOutputLogger if self.json_output else GradingOutputLogger
@@ -50,6 +82,7 @@ class Grader:
             self.config.assignment_name,
             self.config.total_points_possible,
             self.config.generate_results,
+            self.config.generate_student_resource_usage,
         )
         self.extra_testcase_types = [StdoutOnlyTestCase] if self.config.stdout_only_grading_enabled else []
 
@@ -57,40 +90,218 @@ class Grader:
         io_choices = {}
         try:
             self._prepare_directory_structure()
-            self.submissions = self._gather_submissions()
-            io_choices = self._gather_io()
-            # also copies testcase_utils to temp dir
-            self.tests, unused_io_choices = self._gather_testcases(io_choices.copy())
-            if self.config.stdout_only_grading_enabled:
-                self.tests[StdoutOnlyTestCase] = self._generate_stdout_only_testcases(unused_io_choices)
-
-            # Allows for consistent output
-            for test_list in self.tests.values():
-                test_list.sort(key=lambda t: t.path.name)
-
-            precompilation_tasks = itertools.chain.from_iterable(
-                (t.precompile_testcase(self.config.testcase_precompilation_args[t.name]) for t in t_lst)
-                for t_lst in self.tests.values()
-            )
-
-            if sys.platform == "win32":
-                asyncio.set_event_loop(asyncio.ProactorEventLoop())
-            semaphore = asyncio.Semaphore(self.config.max_concurrent_submissions)
-            tasks = map(Runner(self, asyncio.Lock(), self.testcase_picker, semaphore), self.submissions)
-            asyncio.get_event_loop().run_until_complete(asyncio.gather(*precompilation_tasks))
-            modified_submissions = asyncio.get_event_loop().run_until_complete(asyncio.gather(*tasks))
-            # https://github.com/python/typeshed/issues/2652
-            modified_submissions = cast(List[Submission], modified_submissions)
+            with tracer.span("gather_submissions"):
+                self.submissions = self._gather_submissions()
+            with tracer.span("gather_testcases"):
+                io_choices = self._gather_io()
+                self._gather_all_testcases(io_choices)
+            if self.executor == "process":
+                modified_submissions = self._grade_in_worker_processes(io_choices)
+            else:
+                modified_submissions = self._run_in_event_loop(self._grade(self.submissions))
+            self._update_manifest(modified_submissions)
             total_class_points = sum(s.final_grade for s in modified_submissions)
             class_average = round(total_class_points / len(self.submissions))
-            self.logger.print_final_score(modified_submissions, class_average)
-            self.logger.print_key()
+            with tracer.span("log"):
+                self.logger.print_final_score(modified_submissions, class_average)
+                self.logger.print_key()
         finally:
             for io in io_choices.values():
                 io.cleanup()
             self.cleanup()
         return modified_submissions, class_average
 
+    def grade_shard(
+        self, io_contents: Dict[str, Tuple[str, str]], prepared_testcases: "PreparedTestCases", worker_count: int
+    ) -> List[SubmissionResults]:
+        """Grades submissions within a worker process of the process executor.
+        Logging and saving the manifest are left to the parent process and so is preparing the testcases.
+        Concurrency limits are split evenly between the workers.
+        """
+        try:
+            self._prepare_directory_structure()
+            with tracer.span("gather_submissions"):
+                self.submissions = self._gather_submissions()
+            with tracer.span("gather_testcases"):
+                self._gather_all_testcases(self._gather_io(io_contents), prepared_testcases.fingerprints)
+            graded_submissions = self._run_in_event_loop(
+                self._grade(
+                    self.submissions,
+                    log_results=False,
+                    worker_count=worker_count,
+                    prepared_testcases=prepared_testcases,
+                )
+            )
+            return [s.get_results() for s in graded_submissions]
+        finally:
+            self.cleanup()
+
+    async def _grade(
+        self,
+        submissions: List[Submission],
+        log_results: bool = True,
+        worker_count: int = 1,
+        prepared_testcases: Optional["PreparedTestCases"] = None,
+    ) -> List[Submission]:
+        """Testcases are precompiled and measured here unless prepared_testcases have been passed from the parent"""
+        scheduler = Scheduler(
+            max(1, self.config.max_concurrent_compilations // worker_count),
+            max(1, self.config.max_concurrent_testcase_runs // worker_count),
+        )
+        if prepared_testcases is None:
+            await asyncio.gather(
+                *(self._precompile_testcase(t, scheduler) for t in itertools.chain.from_iterable(self.tests.values()))
+            )
+        else:
+            for test in itertools.chain.from_iterable(self.tests.values()):
+                test.path = prepared_testcases.paths[test.name]
+                test.reference_cpu_time = prepared_testcases.reference_cpu_times.get(test.name)
+        semaphore = asyncio.Semaphore(self.config.max_concurrent_submissions)
+        runner = Runner(self, asyncio.Lock(), self.testcase_picker, semaphore, scheduler, log_results)
+        if prepared_testcases is None:
+            await self._measure_reference_cpu_times(runner)
+        # https://github.com/python/typeshed/issues/2652
+        return cast(List[Submission], await asyncio.gather(*map(runner, submissions)))
+
+    async def _measure_reference_cpu_times(self, runner: "Runner") -> None:
+        """Runs the reference solution on every performance-graded testcase.
+        The testcases are measured one by one to keep the measurements as precise as possible.
+        """
+        for testcase_type, tests in self.tests.items():
+            performance_tests = [t for t in tests if t.performance is not None]
+            if not performance_tests:
+                continue
+            reference = self._find_reference_solution(testcase_type)
+            try:
+                precompiled_reference = await runner.precompile(reference, runner.lock)
+            except ShellError as e:
+                raise AutograderError(e.format(f"Failed to precompile reference solution '{reference.old_path}':"))
+            for test in performance_tests:
+                test.reference_cpu_time = await test.measure_reference_cpu_time(
+                    precompiled_reference,
+                    self.config.testcase_compilation_args[test.name],
+                    self.config.testcase_runtime_args[test.name],
+                    runner.scheduler,
+                )
+                if test.reference_cpu_time is None:
+                    raise AutograderError(f"Reference solution '{reference.old_path}' fails testcase '{test.name}'")
+
+    async def _prepare_testcases_for_workers(self) -> "PreparedTestCases":
+        """Precompiles the testcases once for all of the worker processes and measures the reference solution
+        before they start so that no student submissions compete with it for the CPU.
+        The workers run the testcases straight from our temporary directory
+        """
+        tests = list(itertools.chain.from_iterable(self.tests.values()))
+        scheduler = Scheduler(self.config.max_concurrent_compilations, self.config.max_concurrent_testcase_runs)
+        await asyncio.gather(*(self._precompile_testcase(t, scheduler) for t in tests))
+        runner = Runner(self, asyncio.Lock(), self.testcase_picker, asyncio.Semaphore(1), scheduler, log_results=False)
+        await self._measure_reference_cpu_times(runner)
+        return PreparedTestCases(
+            {t.name: t.path for t in tests},
+            self.testcase_fingerprints,
+            {t.name: t.reference_cpu_time for t in tests if t.reference_cpu_time is not None},
+        )
+
+    def _find_reference_solution(self, testcase_type: Type[TestCase]) -> Submission:
+        if self.paths.reference_dir.exists():
+            for path in sorted(self.paths.reference_dir.iterdir()):
+                reference_type = self.testcase_picker.pick(
+                    path, self.config.possible_source_file_stems, self.extra_testcase_types
+                )
+                if reference_type is testcase_type:
+                    return Submission(path, testcase_type)
+        raise AutograderError(
+            f"Performance-graded {testcase_type.__name__} testcases require a reference solution "
+            f"of the same type in '{self.paths.reference_dir}'"
+        )
+
+    async def _precompile_testcase(self, test: TestCase, scheduler: Scheduler) -> None:
+        async with scheduler.compilation:
+            with tracer.span("precompile_testcase", testcase=test.name):
+                await test.precompile_testcase(self.config.testcase_precompilation_args[test.name])
+
+    @staticmethod
+    def _run_in_event_loop(coroutine: Awaitable[T]) -> T:
+        if sys.platform == "win32":
+            asyncio.set_event_loop(asyncio.ProactorEventLoop())
+        return asyncio.get_event_loop().run_until_complete(coroutine)
+
+    def _grade_in_worker_processes(self, io_choices: Dict[str, TestCaseIO]) -> List[Submission]:
+        """Each worker process gets its own event loop and reports its results back to us for logging"""
+        io_contents = {stem: io.get_contents() for stem, io in io_choices.items()}
+        prepared_testcases = self._run_in_event_loop(self._prepare_testcases_for_workers())
+        submissions = {s.old_path.name: s for s in self.submissions}
+        names = list(submissions)
+        # Several small shards per worker allow us to log results while other shards are still being graded
+        shard_count = min(len(names), self.workers * SHARDS_PER_WORKER)
+        shards = [names[i::shard_count] for i in range(shard_count)]
+        with ProcessPoolExecutor(self.workers) as executor:
+            futures = [
+                executor.submit(
+                    _grade_shard,
+                    self.paths.current_dir,
+                    shard,
+                    io_contents,
+                    prepared_testcases,
+                    self.config.use_cache,
+                    self.workers,
+                    tracer.enabled,
+                )
+                for shard in shards
+            ]
+            for future in as_completed(futures):
+                shard_results, spans = future.result()
+                tracer.merge(spans)
+                for results in shard_results:
+                    submission = submissions[results.name]
+                    submission.set_results(results)
+                    submission._temp_dir.cleanup()
+                    with tracer.span("log"):
+                        self.logger.print_single_student_grading_results(submission)
+        return self.submissions
+
+    def _gather_all_testcases(
+        self, io_choices: Dict[str, TestCaseIO], testcase_fingerprints: Optional[Dict[str, str]] = None
+    ) -> None:
+        """testcase_fingerprints are only computed if they haven't been computed before (e.g. by the parent process).
+        Submissions get fingerprinted here as well because their grades depend on which testcases they get
+        """
+        # also copies testcase_utils to temp dir
+        self.tests, unused_io_choices = self._gather_testcases(io_choices.copy())
+        if self.config.stdout_only_grading_enabled:
+            self.tests[StdoutOnlyTestCase] = self._generate_stdout_only_testcases(unused_io_choices)
+
+        # Allows for consistent output
+        for test_list in self.tests.values():
+            test_list.sort(key=lambda t: t.path.name)
+        if testcase_fingerprints is None:
+            testcase_fingerprints = {
+                t.name: get_testcase_fingerprint(
+                    t,
+                    self.paths.testcases_dir / t.name,
+                    self.config,
+                    self.paths.stdout_formatters,
+                    self.paths.reference_dir,
+                )
+                for t in itertools.chain.from_iterable(self.tests.values())
+            }
+        self.testcase_fingerprints = testcase_fingerprints
+        self.submission_fingerprints = {
+            s.old_path.name: get_submission_fingerprint(
+                s, self.config, self.paths.extra_dir, self.tests.get(s.type, [])
+            )
+            for s in self.submissions
+        }
+
+    def _update_manifest(self, submissions: List[Submission]) -> None:
+        if not self.config.generate_results:
+            return
+        for submission in submissions:
+            self.manifest.record(
+                submission, self.submission_fingerprints[submission.old_path.name], self.testcase_fingerprints
+            )
+        self.manifest.save()
+
     def cleanup(self) -> None:
         if self.temp_dir.exists():
             # Windows doesn't know how to clean processes in time...
@@ -104,6 +315,10 @@ class Grader:
         self._check_required_directories_exist()
         if self.config.generate_results:
             self.paths.results_dir.mkdir(exist_ok=True)
+        self.manifest = GradingManifest(
+            self.paths.results_dir / MANIFEST_FILE_NAME,
+            load_previous_grades=self.config.use_cache and self.config.generate_results,
+        )
 
     def _check_required_directories_exist(self) -> None:
         for directory in self.paths.required_dirs:
@@ -141,7 +356,8 @@ class Grader:
         submissions.sort(key=lambda s: s.old_path)
         return submissions
 
-    def _gather_io(self) -> Dict[str, TestCaseIO]:
+    def _gather_io(self, contents: Optional[Dict[str, Tuple[str, str]]] = None) -> Dict[str, TestCaseIO]:
+        """contents are the already read (input, expected output) pairs. Used when the files have been hidden"""
         outputs = get_file_names(self.paths.output_dir)
         inputs = get_file_names(self.paths.input_dir)
         io: Set[str] = set(outputs).union(inputs)
@@ -152,6 +368,7 @@ class Grader:
                 self.stdout_formatters,
                 self.paths.input_dir,
                 self.paths.output_dir,
+                None if contents is None else contents.get(p.stem, ("", "")),
             )
             for p in io_set
         }
@@ -166,6 +383,9 @@ class Grader:
                 io,
                 self.config.file,
                 self.testcase_picker,
+                max_output_bytes=self.config.max_output_bytes[io.name],
+                resource_limits=get_resource_limits(self.config, io.name),
+                performance=get_performance_grading(self.config, io.name),
             )
             for io in io_choices.values()
             if io.expected_output
@@ -197,6 +417,9 @@ class Grader:
                     io.pop(test.stem, EMPTY_TESTCASE_IO),
                     self.config.file,
                     self.testcase_picker,
+                    max_output_bytes=self.config.max_output_bytes[test.name],
+                    resource_limits=get_resource_limits(self.config, test.name),
+                    performance=get_performance_grading(self.config, test.name),
                 )
             )
         return tests, io
@@ -210,6 +433,30 @@ class Grader:
             return {}
 
 
+def _grade_shard(
+    current_dir: Path,
+    submissions: List[str],
+    io_contents: Dict[str, Tuple[str, str]],
+    prepared_testcases: "PreparedTestCases",
+    use_cache: bool,
+    worker_count: int,
+    trace: bool,
+) -> Tuple[List[SubmissionResults], List[Span]]:
+    """Returns the results along with the spans recorded within the worker"""
+    tracer.enabled = trace
+    tracer.reset()
+    grader = Grader(current_dir, submissions=submissions, use_cache=use_cache)
+    return grader.grade_shard(io_contents, prepared_testcases, worker_count), tracer.spans
+
+
+class PreparedTestCases(NamedTuple):
+    """What the parent process computes about the testcases once for all of the worker processes"""
+
+    paths: Dict[str, Path]  # Precompiled testcases by their names
+    fingerprints: Dict[str, str]
+    reference_cpu_times: Dict[str, float]
+
+
 class AutograderPaths:
     __slots__ = (
         "current_dir",
@@ -218,6 +465,7 @@ class AutograderPaths:
         "tests_dir",
         "testcases_dir",
         "extra_dir",
+        "reference_dir",
         "input_dir",
         "output_dir",
         "stdout_formatters",
@@ -231,6 +479,7 @@ class AutograderPaths:
 
     testcases_dir: Path
     extra_dir: Path
+    reference_dir: Path
     input_dir: Path
     output_dir: Path
     stdout_formatters: Path
@@ -251,6 +500,7 @@ class AutograderPaths:
 
         self.testcases_dir = self.tests_dir / "testcases"
         self.extra_dir = self.tests_dir / "extra"
+        self.reference_dir = self.tests_dir / "reference"
         self.input_dir = self.tests_dir / "input"
         self.output_dir = self.tests_dir / "output"
 
@@ -276,21 +526,27 @@ class Runner:
         lock: asyncio.Lock,
         testcase_picker: TestCasePicker,
         semaphore: asyncio.Semaphore,
+        scheduler: Scheduler,
+        log_results: bool = True,
     ) -> None:
         self.grader = grader
         self.lock = lock
         self.testcase_picker = testcase_picker
         self.semaphore = semaphore
+        self.scheduler = scheduler
+        self.log_results = log_results
 
     async def __call__(self, submission: Submission) -> Submission:
         async with self.semaphore:
-            await self.run_on_single_submission(submission, self.lock)
+            with tracer.tags(submission=submission.old_path.name):
+                await self.run_on_single_submission(submission, self.lock)
             return submission
 
     async def run_on_single_submission(self, submission: Submission, lock: asyncio.Lock) -> None:
-        self._copy_extra_files(submission.temp_dir)
         await self._get_testcase_output(submission, lock)
-        self.grader.logger.print_single_student_grading_results(submission)
+        if self.log_results:
+            with tracer.span("log"):
+                self.grader.logger.print_single_student_grading_results(submission)
         # Windows sucks at cleaning up processes early
         if not sys.platform.startswith("win32"):
             # Cleanup after running tests on student submission
@@ -308,31 +564,42 @@ class Runner:
 
         Note: Has side effects in submission instance
         """
-        try:
-            precompiled_submission = await submission.type.precompile_submission(
-                submission.old_path,
-                submission.temp_dir,
-                self.grader.config.possible_source_file_stems,
-                self.grader.config.submission_precompilation_args[submission.old_path.name],
-                self.grader.config,
-                lock,
-                self.testcase_picker,
-            )
-        except ShellError as e:
-            error = hide_path_to_directory(e.format("Failed to precompile:"), submission.temp_dir)
-            submission.register_precompilation_error(error)
+        manifest = self.grader.manifest
+        fingerprint = self.grader.submission_fingerprints[submission.old_path.name]
+        cached_error = manifest.get_precompilation_error(submission, fingerprint)
+        if cached_error is not None:
+            submission.register_precompilation_error(cached_error)
             return
         allowed_tests = self.grader.tests.get(submission.type, [])
+        cached_grades = {
+            t.name: manifest.get_grade(submission, fingerprint, t.name, self.grader.testcase_fingerprints[t.name])
+            for t in allowed_tests
+        }
+        if not allowed_tests or None in cached_grades.values():
+            try:
+                precompiled_submission = await self.precompile(submission, lock)
+            except ShellError as e:
+                error = hide_path_to_directory(e.format("Failed to precompile:"), submission.temp_dir)
+                submission.register_precompilation_error(error)
+                return
         if not allowed_tests:
             submission.register_precompilation_error("No suitable testcases found.")
             return
-        submission.type.run_additional_testcase_operations_in_student_dir(submission.temp_dir)
-        for test in allowed_tests:
-            result = await test.run(
-                precompiled_submission,
-                self.grader.config.testcase_compilation_args[test.name],
-                self.grader.config.testcase_runtime_args[test.name],
+        stale_tests = [t for t in allowed_tests if cached_grades[t.name] is None]
+        if self.grader.config.parallel_testcases:
+            # Results are gathered in the original order which keeps the output consistent
+            results = await asyncio.gather(
+                *(self._run_testcase_in_separate_dir(t, precompiled_submission) for t in stale_tests)
             )
+        else:
+            results = [await self._run_testcase(t, precompiled_submission) for t in stale_tests]
+        new_results = {t.name: r for t, r in zip(stale_tests, results)}
+        for test in allowed_tests:
+            cached_grade = cached_grades[test.name]
+            if cached_grade is not None:
+                submission.grades[test.name] = cached_grade
+                continue
+            result = new_results[test.name]
             message = hide_path_to_directory(result.message, submission.temp_dir)
             submission.add_grade(
                 test.name,
@@ -340,5 +607,55 @@ class Runner:
                 test.weight,
                 message,
                 result.extra_output_fields,
+                result.resource_usage,
             )
         submission.register_final_grade(self.grader.config.total_score_to_100_ratio)
+
+    async def precompile(self, submission: Submission, lock: asyncio.Lock) -> Path:
+        """Prepares the student directory of the submission for running testcases"""
+        self._copy_extra_files(submission.temp_dir)
+        async with self.scheduler.compilation:
+            with tracer.span("precompile_submission"):
+                precompiled_submission = await submission.type.precompile_submission(
+                    submission.old_path,
+                    submission.temp_dir,
+                    self.grader.config.possible_source_file_stems,
+                    self.grader.config.submission_precompilation_args[submission.old_path.name],
+                    self.grader.config,
+                    lock,
+                    self.testcase_picker,
+                )
+        submission.type.run_additional_testcase_operations_in_student_dir(submission.temp_dir)
+        return precompiled_submission
+
+    async def _run_testcase(self, test: TestCase, precompiled_submission: Path) -> TestCaseResult:
+        return await test.run(
+            precompiled_submission,
+            self.grader.config.testcase_compilation_args[test.name],
+            self.grader.config.testcase_runtime_args[test.name],
+            self.scheduler,
+        )
+
+    async def _run_testcase_in_separate_dir(self, test: TestCase, precompiled_submission: Path) -> TestCaseResult:
+        """Gives the testcase its own copy of the student directory so that
+        testcases running at the same time do not interfere with each other's files
+        """
+        student_dir = precompiled_submission.parent
+        testcase_dir = student_dir / f"{TESTCASE_DIR_PREFIX}{test.name}"
+        testcase_dir.mkdir()
+        for path in student_dir.iterdir():
+            if path.name.startswith(TESTCASE_DIR_PREFIX):
+                continue
+            elif path.is_dir():
+                shutil.copytree(str(path), str(testcase_dir / path.name))
+            else:
+                shutil.copy(str(path), str(testcase_dir / path.name))
+        if isinstance(precompiled_submission, PathWithStdoutOnlyInfo):
+            relocated_submission: Path = PathWithStdoutOnlyInfo(
+                testcase_dir / precompiled_submission.name,
+                compiled_submission=precompiled_submission.compiled_submission,
+                picked_testcase_type=precompiled_submission.picked_testcase_type,
+            )
+        else:
+            relocated_submission = testcase_dir / precompiled_submission.name
+        return await self._run_testcase(test, relocated_submission)
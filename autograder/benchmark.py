@@ -0,0 +1,110 @@
+"""Measures grading throughput on synthetic classes generated from the testcase templates"""
+
+import contextlib
+import os
+import shutil
+import statistics
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List, Mapping, Optional, Type
+
+from tomlkit.api import dumps
+
+from .autograder import Grader
+from .config_manager import MAIN_CONFIG_SECTION
+from .testcase_utils.abstract_testcase import TestCase
+from .tracing import PHASES, tracer
+
+# The only file stem that the templates of all languages share (java requires the class name to match the file name)
+BENCHMARK_SOURCE_FILE_STEM = "Homework"
+
+
+@dataclass
+class BenchmarkResult:
+    language: str
+    submission_count: int
+    testcase_count: int
+    wall_times: List[float] = field(default_factory=list)
+    # Phase durations are summed over concurrently running operations so they can exceed the wall time
+    phase_durations: Dict[str, List[float]] = field(default_factory=dict)
+
+    @property
+    def wall_time(self) -> float:
+        return statistics.median(self.wall_times)
+
+    @property
+    def submissions_per_second(self) -> float:
+        return self.submission_count / self.wall_time
+
+    def format(self) -> str:
+        repeats = len(self.wall_times)
+        lines = [
+            f"Language: {self.language} ({self.submission_count} submissions x {self.testcase_count} testcases)",
+            f"  Wall time: {self.wall_time:.3f}s (median of {repeats} runs)",
+            f"  Throughput: {self.submissions_per_second:.2f} submissions/s",
+            f"  {'Phase':<24}{'Count':>8}{'Total (s)':>12}{'Mean (ms)':>12}",
+        ]
+        for phase in PHASES:
+            durations = self.phase_durations.get(phase, [])
+            total = sum(durations) / repeats
+            mean = statistics.mean(durations) * 1000 if durations else 0.0
+            lines.append(f"  {phase:<24}{len(durations) // repeats:>8}{total:>12.3f}{mean:>12.2f}")
+        return "\n".join(lines)
+
+
+def generate_class(directory: Path, testcase_type: Type[TestCase], submission_count: int, testcase_count: int) -> None:
+    """Fills directory with copies of the template submission and the template testcases of testcase_type"""
+    template_dir = testcase_type.get_template_dir()
+    sample_submission = next(p for p in template_dir.iterdir() if p.is_file())
+    for i in range(submission_count):
+        shutil.copy(sample_submission, directory / f"student{i}_{BENCHMARK_SOURCE_FILE_STEM}{sample_submission.suffix}")
+
+    templates = sorted((template_dir / "tests" / "testcases").iterdir())
+    testcases_dir = directory / "tests" / "testcases"
+    output_dir = directory / "tests" / "output"
+    testcases_dir.mkdir(parents=True)
+    output_dir.mkdir()
+    for i in range(testcase_count):
+        template = templates[i % len(templates)]
+        # Java requires the class name to match the file name so we rename the class as well
+        stem = f"Test{i}"
+        (testcases_dir / f"{stem}{template.suffix}").write_text(template.read_text().replace(template.stem, stem))
+        expected_output = template_dir / "tests" / "output" / f"{template.stem}.txt"
+        if expected_output.exists():
+            shutil.copy(expected_output, output_dir / f"{stem}.txt")
+
+
+def run_benchmark(
+    testcase_type: Type[TestCase],
+    language: str,
+    submission_count: int,
+    testcase_count: int,
+    repeats: int = 1,
+    config: Optional[Mapping[str, object]] = None,
+    use_cache: bool = False,
+    executor: str = "async",
+    workers: Optional[int] = None,
+) -> BenchmarkResult:
+    """config contains the overrides of the main config section"""
+    result = BenchmarkResult(language, submission_count, testcase_count)
+    with TemporaryDirectory() as tmpdir:
+        class_dir = Path(tmpdir)
+        generate_class(class_dir, testcase_type, submission_count, testcase_count)
+        benchmark_config = {"POSSIBLE_SOURCE_FILE_STEMS": [BENCHMARK_SOURCE_FILE_STEM], **(config or {})}
+        (class_dir / "tests" / "config.toml").write_text(dumps({MAIN_CONFIG_SECTION: benchmark_config}))
+        tracer.enabled = True
+        try:
+            for _ in range(repeats):
+                tracer.reset()
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    Grader(class_dir, use_cache=use_cache, executor=executor, workers=workers).run()
+                result.wall_times.append(time.perf_counter() - start)
+                for phase, durations in tracer.get_durations().items():
+                    result.phase_durations.setdefault(phase, []).extend(durations)
+        finally:
+            tracer.enabled = False
+            tracer.reset()
+    return result
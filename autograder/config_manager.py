@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Generic, List, Mapping, Optional, TypeVar
@@ -8,6 +9,8 @@ from tomlkit.container import Container
 DEFAULT_FILE_STEM = "Homework"
 MAIN_CONFIG_SECTION = "CONFIG"
 DEFAULT_ARGLIST_VALUE_KEY = "DEFAULT"
+DEFAULT_MAX_OUTPUT_BYTES = 10_000_000
+DEFAULT_PERFORMANCE_CURVE = [[1.5, 100], [4, 0]]
 
 
 TESTNAME = TypeVar("TESTNAME", bound=str)
@@ -33,11 +36,26 @@ class GradingConfig:
     file: Mapping[str, Any]
 
     timeouts: ArgList[str, float]
+    max_output_bytes: ArgList[str, int]
+    memory_limits: ArgList[str, float]
+    cpu_time_limits: ArgList[str, float]
+    process_limits: ArgList[str, int]
+    file_size_limits: ArgList[str, float]
+    performance_runs: ArgList[str, int]
+    performance_warmup_runs: ArgList[str, int]
+    performance_curves: ArgList[str, List[List[float]]]
     generate_results: bool
     generate_student_outputs: bool
+    record_resource_usage: bool
+    generate_student_resource_usage: bool
     stdout_only_grading_enabled: bool
+    parallel_testcases: bool
+    use_cache: bool
+    compilation_cache_size: float
     total_points_possible: int
     max_concurrent_submissions: int
+    max_concurrent_compilations: int
+    max_concurrent_testcase_runs: int
     total_score_to_100_ratio: float
 
     assignment_name: str
@@ -57,12 +75,27 @@ class GradingConfig:
         self.file = global_config
         cfg = global_config[MAIN_CONFIG_SECTION]
         self.timeouts = ArgList(cfg["TIMEOUT"], 1)
+        self.max_output_bytes = ArgList(cfg["MAX_OUTPUT_BYTES"], DEFAULT_MAX_OUTPUT_BYTES)
+        self.memory_limits = ArgList(cfg["MEMORY_LIMIT"], 0)
+        self.cpu_time_limits = ArgList(cfg["CPU_TIME_LIMIT"], 0)
+        self.process_limits = ArgList(cfg["PROCESS_LIMIT"], 0)
+        self.file_size_limits = ArgList(cfg["FILE_SIZE_LIMIT"], 0)
+        self.performance_runs = ArgList(cfg["PERFORMANCE_RUNS"], 0)
+        self.performance_warmup_runs = ArgList(cfg["PERFORMANCE_WARMUP_RUNS"], 1)
+        self.performance_curves = ArgList(cfg["PERFORMANCE_CURVE"], DEFAULT_PERFORMANCE_CURVE)
         self.generate_results = cfg["GENERATE_RESULTS"]
         self.generate_student_outputs = cfg["GENERATE_STUDENT_OUTPUTS"]
+        self.record_resource_usage = cfg["RECORD_RESOURCE_USAGE"]
+        self.generate_student_resource_usage = cfg["GENERATE_STUDENT_RESOURCE_USAGE"]
         self.stdout_only_grading_enabled = cfg["STDOUT_ONLY_GRADING_ENABLED"]
+        self.parallel_testcases = cfg["PARALLEL_TESTCASES"]
+        self.use_cache = cfg["USE_CACHE"]
+        self.compilation_cache_size = cfg["COMPILATION_CACHE_SIZE"]
 
         self.total_points_possible = cfg["TOTAL_POINTS_POSSIBLE"]
         self.max_concurrent_submissions = cfg["MAX_CONCURRENT_SUBMISSIONS"]
+        self.max_concurrent_compilations = cfg["MAX_CONCURRENT_COMPILATIONS"] or os.cpu_count() or 1
+        self.max_concurrent_testcase_runs = cfg["MAX_CONCURRENT_TESTCASE_RUNS"] or os.cpu_count() or 1
         self.total_score_to_100_ratio = self.total_points_possible / 100
 
         self.assignment_name = cfg["ASSIGNMENT_NAME"]
@@ -81,6 +114,11 @@ class GradingConfig:
         self.testcase_compilation_args = ArgList(cfg["TESTCASE_COMPILATION_ARGS"], "")
         self.testcase_runtime_args = ArgList(cfg["TESTCASE_RUNTIME_ARGS"], "")
 
+    def disable_cache(self) -> None:
+        # Testcase types only receive the raw config so we have to disable the cache there as well
+        self.file[MAIN_CONFIG_SECTION]["USE_CACHE"] = False  # type: ignore
+        self.use_cache = False
+
 
 def _read_config(config: Path, fallback_config: Optional[Path] = None) -> Mapping[str, Any]:
     if fallback_config is None:
@@ -0,0 +1,134 @@
+import dataclasses
+import functools
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from . import __version__
+from .config_manager import MAIN_CONFIG_SECTION, GradingConfig
+from .testcase_utils.abstract_testcase import TestCase
+from .testcase_utils.performance import get_performance_grading
+from .testcase_utils.resource_limits import get_resource_limits
+from .testcase_utils.shell import ResourceUsage
+from .testcase_utils.submission import Submission, TestCaseGrade
+from .util import get_content_hash, get_path_hash
+
+L = logging.getLogger("AUTOGRADER.grading_manifest")
+
+MANIFEST_FILE_NAME = ".grading_manifest.json"
+MANIFEST_VERSION = 1
+# Grades depend on the code that produced them (the grader itself, its config defaults, the testcase types,
+# the default formatters, etc) so they are invalidated whenever any of it changes, even between releases.
+# Only the code that can't affect the grades is left out
+NON_GRADING_CODE_DIRS = ("plagiarism_detection", "__pycache__")
+
+
+class GradingManifest:
+    """Remembers the grades of every (submission, testcase) pair from previous runs
+    along with the fingerprints of everything that the grades depended on.
+    This allows the grader to only re-run the pairs whose inputs have changed.
+    """
+
+    path: Path
+    submissions: Dict[str, Dict[str, Any]]
+
+    def __init__(self, path: Path, load_previous_grades: bool = True) -> None:
+        self.path = path
+        self.submissions = {}
+        if load_previous_grades and path.is_file():
+            try:
+                manifest = json.loads(path.read_text())
+            except ValueError:
+                L.warning(f"Grading manifest '{path}' is corrupted. All submissions will be regraded.")
+            else:
+                if manifest.get("version") == MANIFEST_VERSION:
+                    self.submissions = manifest["submissions"]
+
+    def get_precompilation_error(self, submission: Submission, fingerprint: str) -> Optional[str]:
+        entry = self.submissions.get(submission.old_path.name)
+        if entry is None or entry["fingerprint"] != fingerprint or not entry["precompilation_error"]:
+            return None
+        return entry["precompilation_error"]
+
+    def get_grade(
+        self, submission: Submission, fingerprint: str, test_name: str, test_fingerprint: str
+    ) -> Optional[TestCaseGrade]:
+        entry = self.submissions.get(submission.old_path.name)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+        grade = entry["grades"].get(test_name)
+        if grade is None or grade["fingerprint"] != test_fingerprint:
+            return None
+        cached_grade = TestCaseGrade(**grade["grade"])
+        if cached_grade.resource_usage is not None:
+            cached_grade.resource_usage = ResourceUsage(**cached_grade.resource_usage)  # type: ignore
+        return cached_grade
+
+    def record(self, submission: Submission, fingerprint: str, testcase_fingerprints: Dict[str, str]) -> None:
+        self.submissions[submission.old_path.name] = {
+            "fingerprint": fingerprint,
+            "precompilation_error": submission.precompilation_error,
+            "grades": {
+                test_name: {"fingerprint": testcase_fingerprints[test_name], "grade": dataclasses.asdict(grade)}
+                for test_name, grade in submission.grades.items()
+            },
+        }
+
+    def save(self) -> None:
+        self.path.write_text(json.dumps({"version": MANIFEST_VERSION, "submissions": self.submissions}))
+
+
+def get_submission_fingerprint(
+    submission: Submission, config: GradingConfig, extra_dir: Path, testcases: List[TestCase]
+) -> str:
+    """testcases are the ones that the submission gets graded with. Adding or removing them changes
+    more than their own grades (e.g. a submission without any testcases is not graded at all)
+    """
+    extra_config_sections = {k: v for k, v in config.file.items() if k != MAIN_CONFIG_SECTION}
+    return get_content_hash(
+        get_grading_code_hash(),
+        get_path_hash(submission.old_path),
+        get_path_hash(extra_dir),
+        str(config.submission_precompilation_args[submission.old_path.name]),
+        str(config.possible_source_file_stems),
+        str(extra_config_sections),
+        submission.type.__name__,
+        str(sorted(t.name for t in testcases)),
+    )
+
+
+def get_testcase_fingerprint(
+    test: TestCase, original_path: Path, config: GradingConfig, formatters: Path, reference_dir: Path
+) -> str:
+    performance = get_performance_grading(config, test.name)
+    return get_content_hash(
+        get_grading_code_hash(),
+        get_path_hash(original_path),
+        get_path_hash(formatters),
+        # Performance-graded testcases depend on the reference solution as well
+        get_path_hash(reference_dir) if performance is not None else "",
+        str(performance),
+        test.io.input,
+        test.io.expected_output_backup,
+        str(config.timeouts[test.name]),
+        str(config.max_output_bytes[test.name]),
+        str(get_resource_limits(config, test.name)),
+        str(config.testcase_weights[test.name]),
+        str(config.testcase_precompilation_args[test.name]),
+        str(config.testcase_compilation_args[test.name]),
+        str(config.testcase_runtime_args[test.name]),
+        str(config.generate_student_outputs),
+        str(config.record_resource_usage),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_grading_code_hash() -> str:
+    package_dir = Path(__file__).parent
+    parts = [__version__]
+    for path in sorted(package_dir.rglob("*")):
+        relative_path = path.relative_to(package_dir)
+        if path.is_file() and not any(d in relative_path.parts for d in NON_GRADING_CODE_DIRS):
+            parts.extend((relative_path.as_posix(), path.read_bytes()))
+    return get_content_hash(*parts)
@@ -1,6 +1,7 @@
 # Controls output to stdout and to output file
 
 
+import dataclasses
 import json
 from collections import deque
 from pathlib import Path
@@ -15,6 +16,8 @@ KEY = """
 \tCrashed due to signal SIGNAL_CODE: Your submission threw an uncaught exception.
 \tAll signal error codes are described here: https://man7.org/linux/man-pages/man7/signal.7.html
 \tExceeded Time Limit: Your submission took too much time to run (probably an infinite loop)
+\tExceeded Output Limit: Your submission printed too much output (probably an infinite loop)
+\tExceeded Memory/CPU Time/Process/File Size Limit: Your submission used more resources than it is allowed to
 """
 
 
@@ -34,10 +37,12 @@ class GradingOutputLogger:
         assignment_name: str,
         total_points_possible: int,
         generate_results: bool,
+        generate_resource_usage: bool = False,
     ):
         self.results_dir = path_to_results_dir
         self.assignment_name = assignment_name
         self.total_points_possible = total_points_possible
+        self.generate_resource_usage = generate_resource_usage
 
         if not generate_results:
             self._silence_generating_results()
@@ -67,12 +72,13 @@ class GradingOutputLogger:
         output_for_student_file = self._format_output_for_student_file(submission, formatted_student_score)
         (self.results_dir / submission.old_path.name).write_text(output_for_student_file)
 
-    @staticmethod
-    def _generate_additional_output(grade: TestCaseGrade) -> str:
+    def _generate_additional_output(self, grade: TestCaseGrade) -> str:
         splitter = f'{35 * "="}\n'
         output = "\n".join([f"{k}:\n{splitter}{v}{splitter}" for k, v in grade.extra_output_fields.items()])
         if output:
             output = "\n" + output
+        if self.generate_resource_usage and grade.resource_usage is not None:
+            output = f" ({grade.resource_usage.format()})" + output
         return output
 
     def _silence_generating_results(self):
@@ -119,6 +125,11 @@ class JsonGradingOutputLogger(GradingOutputLogger):
                         "name": test_name,
                         "message": grade.message,
                         **grade.extra_output_fields,
+                        **(
+                            {"resource_usage": dataclasses.asdict(grade.resource_usage)}
+                            if grade.resource_usage is not None
+                            else {}
+                        ),
                     }
                     for test_name, grade in s.grades.items()
                 ],
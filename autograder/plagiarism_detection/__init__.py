@@ -1 +1 @@
-from .plagiarism_detection import compare
+from .plagiarism_detection import Match, compare, iterate_matches
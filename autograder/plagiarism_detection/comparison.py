@@ -1,26 +1,301 @@
+from typing import Tuple
+
 import numpy as np
-from numba import njit
-
-
-@njit
-def get_similarity(a: np.ndarray, b: np.ndarray, matrix: np.ndarray, self_similarity_sum: int) -> float:
-    dp = np.zeros((len(a), len(b)), dtype=np.int32)
-    # initialize dp with score of matching first token of each token stream
-    dp[0, 0] = max(0, matrix[a[0], b[0]])
-    for i in range(1, len(a)):
-        dp[i, 0] = max(0, dp[i - 1, 0] + matrix[a[i], -1])
-    for i in range(1, len(b)):
-        dp[0, i] = max(0, dp[0, i - 1] + matrix[-1, b[i]])
-    for i in range(1, len(a)):
-        for j in range(1, len(b)):
-            # # score from matching both tokens
-            maxScore = max(
-                (
+from numba import njit, prange
+
+
+@njit(cache=True)
+def get_similarity(
+    a: np.ndarray,
+    b: np.ndarray,
+    matrix: np.ndarray,
+    self_similarity_sum: int,
+    band: int,
+    previous_row: np.ndarray,
+    current_row: np.ndarray,
+    min_score: float = 0.0,
+) -> float:
+    """Scores the alignment of token streams a and b, normalized by the sum of their self similarities.
+
+    Only two rows of the dp matrix are kept at a time. previous_row and current_row are int64
+    buffers of at least len(b) elements that can be reused between calls.
+    If band > 0, only the cells within band columns of the diagonal are computed
+    while the rest of them are treated as 0 (i.e. as unrelated code).
+
+    If the score provably can't reach min_score, the alignment is abandoned early
+    and an upper bound of the score (which is below min_score) is returned instead.
+    Streams without any tokens (e.g. empty files) have nothing in common so their score is 0.
+    """
+    if self_similarity_sum == 0:
+        return 0.0
+    n, m = len(a), len(b)
+    gap = matrix.shape[0] - 1
+    # Only matching identical tokens increases the score so the rows below the current one
+    # can't add more than the self similarity of the rest of a
+    remaining_self_similarity = 0
+    if min_score > 0:
+        for i in range(n):
+            remaining_self_similarity += matrix[a[i], a[i]]
+    # The diagonal goes from the first tokens to the last ones even if the streams have different lengths
+    slope = (m - 1) / max(n - 1, 1)
+    previous_lo, previous_hi = 0, -1
+    for i in range(n):
+        if band > 0:
+            center = int(round(i * slope))
+            lo, hi = max(0, center - band), min(m - 1, center + band)
+        else:
+            lo, hi = 0, m - 1
+        for j in range(lo, hi + 1):
+            up = previous_row[j] if previous_lo <= j <= previous_hi else 0
+            if i == 0 and j == 0:
+                # initialize dp with score of matching first token of each token stream
+                score = max(0, matrix[a[0], b[0]])
+            elif i == 0:
+                score = max(0, current_row[j - 1] + matrix[gap, b[j]])
+            elif j == 0:
+                score = max(0, up + matrix[a[i], gap])
+            else:
+                diagonal = previous_row[j - 1] if previous_lo <= j - 1 <= previous_hi else 0
+                left = current_row[j - 1] if j > lo else 0
+                # score from matching both tokens, from skipping a token in a, and from skipping a token in b
+                score = max(
                     0,
-                    dp[i - 1, j - 1] + matrix[a[i], b[j]],
-                    dp[i - 1, j] + matrix[a[i], -1],
-                    dp[i, j - 1] + matrix[-1, b[j]],
+                    diagonal + matrix[a[i], b[j]],
+                    up + matrix[a[i], gap],
+                    left + matrix[gap, b[j]],
                 )
+            current_row[j] = score
+        if min_score > 0:
+            remaining_self_similarity -= matrix[a[i], a[i]]
+            row_max = current_row[lo : hi + 1].max() if lo <= hi else 0
+            upper_bound = (row_max + remaining_self_similarity) * 2 / self_similarity_sum
+            if upper_bound < min_score:
+                return upper_bound
+        previous_row, current_row = current_row, previous_row
+        previous_lo, previous_hi = lo, hi
+    last = previous_row[m - 1] if previous_lo <= m - 1 <= previous_hi else 0
+    return last * 2 / self_similarity_sum
+
+
+@njit(cache=True)
+def get_bounded_similarity(
+    a: np.ndarray,
+    b: np.ndarray,
+    histogram_a: np.ndarray,
+    histogram_b: np.ndarray,
+    matrix: np.ndarray,
+    self_similarity_sum: int,
+    band: int,
+    previous_row: np.ndarray,
+    current_row: np.ndarray,
+    min_score: float,
+) -> float:
+    """Same as get_similarity but skips the alignment altogether if the token histograms of a and b
+    already show that the score can't reach min_score. Every token can only be matched once and only matching
+    identical tokens increases the score so the score can't exceed the self similarity of the tokens in common.
+    """
+    if self_similarity_sum == 0:
+        return 0.0
+    if min_score > 0:
+        common_self_similarity = 0
+        for token in range(len(histogram_a)):
+            common_self_similarity += min(histogram_a[token], histogram_b[token]) * matrix[token, token]
+        upper_bound = common_self_similarity * 2 / self_similarity_sum
+        if upper_bound < min_score:
+            return upper_bound
+    return get_similarity(a, b, matrix, self_similarity_sum, band, previous_row, current_row, min_score)
+
+
+@njit(cache=True)
+def get_token_histograms(tokens: np.ndarray, offsets: np.ndarray, token_type_count: int) -> np.ndarray:
+    histograms = np.zeros((len(offsets) - 1, token_type_count), dtype=np.int32)
+    for k in range(len(offsets) - 1):
+        for token in tokens[offsets[k] : offsets[k + 1]]:
+            histograms[k, token] += 1
+    return histograms
+
+
+# Every thread gets several chunks of pairs to even out the differences in file lengths
+CHUNKS_PER_THREAD = 8
+
+
+@njit(cache=True)
+def get_max_length(offsets: np.ndarray) -> int:
+    max_length = 0
+    for k in range(len(offsets) - 1):
+        max_length = max(max_length, offsets[k + 1] - offsets[k])
+    return max_length
+
+
+@njit(parallel=True, cache=True)
+def get_all_similarities(
+    tokens: np.ndarray,
+    offsets: np.ndarray,
+    matrix: np.ndarray,
+    self_similarities: np.ndarray,
+    band: int,
+    top: int = 0,
+    min_score: float = 0.0,
+    thread_count: int = 1,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compares every pair of token streams. Returns an array of (i, j) rows with i < j and their scores.
+    Only the pairs whose score is at least min_score are returned. If top > 0, only the top most similar ones are.
+
+    The token stream of file i is tokens[offsets[i] : offsets[i + 1]].
+    The pairs of the upper triangle are flattened into a single index range that is split
+    into chunks which are processed in parallel. Each chunk reuses its own dp rows for all of its pairs.
+    With top > 0, each chunk also keeps its own heap of the most similar pairs so that we never
+    store the scores of all pairs at once.
+
+    The alignments that provably can't reach min_score (or get into a full heap) are abandoned early.
+    thread_count is the number of numba threads. It is passed in because get_num_threads() prevents caching.
+    """
+    count = len(offsets) - 1
+    pair_count = count * (count - 1) // 2
+    max_length = get_max_length(offsets)
+    # The last row of the matrix is the gap which never appears in token streams
+    histograms = get_token_histograms(tokens, offsets, matrix.shape[0] - 1)
+    chunk_count = min(pair_count, thread_count * CHUNKS_PER_THREAD)
+    # Without top, all scores have to be kept until we know how many of them pass min_score
+    similarity_scores = np.zeros(pair_count if top <= 0 else 0)
+    heap_scores = np.full((chunk_count, max(top, 0)), -np.inf)
+    heap_pairs = np.zeros((chunk_count, max(top, 0), 2), dtype=np.int64)
+    for chunk in prange(chunk_count):
+        start = chunk * pair_count // chunk_count
+        end = (chunk + 1) * pair_count // chunk_count
+        previous_row = np.zeros(max_length, dtype=np.int64)
+        current_row = np.zeros(max_length, dtype=np.int64)
+        # Find the pair (i, j) that corresponds to the flat index start
+        i, offset = 0, start
+        while offset >= count - i - 1:
+            offset -= count - i - 1
+            i += 1
+        j = i + 1 + offset
+        for flat_index in range(start, end):
+            # Once the heap is full, pairs that are not more similar than its least similar pair are of no use
+            threshold = max(min_score, heap_scores[chunk, 0]) if top > 0 else min_score
+            score = get_bounded_similarity(
+                tokens[offsets[i] : offsets[i + 1]],
+                tokens[offsets[j] : offsets[j + 1]],
+                histograms[i],
+                histograms[j],
+                matrix,
+                self_similarities[i] + self_similarities[j],
+                band,
+                previous_row,
+                current_row,
+                threshold,
+            )
+            if top <= 0:
+                similarity_scores[flat_index] = score
+            elif score >= min_score and is_less_similar(
+                heap_scores[chunk, 0], heap_pairs[chunk, 0, 0], heap_pairs[chunk, 0, 1], score, i, j
+            ):
+                push_to_heap(heap_scores[chunk], heap_pairs[chunk], score, i, j)
+            j += 1
+            if j == count:
+                i += 1
+                j = i + 1
+    if top > 0:
+        scores, pairs = heap_scores.ravel(), heap_pairs.reshape(-1, 2)
+        kept = np.flatnonzero(scores > -np.inf)
+        # The most similar pairs first. Ties are broken by the pair order to make the results deterministic
+        kept = kept[np.argsort(pairs[kept, 0] * count + pairs[kept, 1], kind="mergesort")]
+        kept = kept[np.argsort(-scores[kept], kind="mergesort")][:top]
+        return pairs[kept], scores[kept]
+    pair_indices = np.flatnonzero(similarity_scores >= min_score)
+    pairs = np.zeros((len(pair_indices), 2), dtype=np.int64)
+    i, j, flat_index = 0, 1, 0
+    for k in range(len(pair_indices)):
+        while flat_index < pair_indices[k]:
+            flat_index += 1
+            j += 1
+            if j == count:
+                i += 1
+                j = i + 1
+        pairs[k, 0], pairs[k, 1] = i, j
+    return pairs, similarity_scores[pair_indices]
+
+
+@njit(cache=True)
+def is_less_similar(score_a: float, i_a: int, j_a: int, score_b: float, i_b: int, j_b: int) -> bool:
+    """Whether pair a ranks below pair b. Ties are broken by the pair order just like in the final results
+    so that the heaps keep the same pairs no matter how the pairs are split into chunks
+    """
+    if score_a != score_b:
+        return score_a < score_b
+    return i_a > i_b or (i_a == i_b and j_a > j_b)
+
+
+@njit(cache=True)
+def push_to_heap(heap_scores: np.ndarray, heap_pairs: np.ndarray, score: float, i: int, j: int) -> None:
+    """Replaces the least similar pair of a full min-heap with (i, j)"""
+    position = 0
+    size = len(heap_scores)
+    while True:
+        child = 2 * position + 1
+        if child >= size:
+            break
+        if child + 1 < size and is_less_similar(
+            heap_scores[child + 1],
+            heap_pairs[child + 1, 0],
+            heap_pairs[child + 1, 1],
+            heap_scores[child],
+            heap_pairs[child, 0],
+            heap_pairs[child, 1],
+        ):
+            child += 1
+        if not is_less_similar(heap_scores[child], heap_pairs[child, 0], heap_pairs[child, 1], score, i, j):
+            break
+        heap_scores[position] = heap_scores[child]
+        heap_pairs[position, 0], heap_pairs[position, 1] = heap_pairs[child, 0], heap_pairs[child, 1]
+        position = child
+    heap_scores[position] = score
+    heap_pairs[position, 0], heap_pairs[position, 1] = i, j
+
+
+@njit(parallel=True, cache=True)
+def get_pair_similarities(
+    tokens: np.ndarray,
+    offsets: np.ndarray,
+    other_tokens: np.ndarray,
+    other_offsets: np.ndarray,
+    matrix: np.ndarray,
+    self_similarities: np.ndarray,
+    other_self_similarities: np.ndarray,
+    band: int,
+    pairs: np.ndarray,
+    min_score: float = 0.0,
+    thread_count: int = 1,
+) -> np.ndarray:
+    """Compares token stream i of tokens to token stream j of other_tokens for every (i, j) row of pairs.
+    Returns the scores in the same order. Both sets of token streams can be the same arrays.
+    The scores that are below min_score are only upper bounds because such alignments are abandoned early.
+    thread_count is the number of numba threads.
+    """
+    pair_count = len(pairs)
+    similarity_scores = np.zeros(pair_count)
+    max_length = get_max_length(other_offsets)
+    histograms = get_token_histograms(tokens, offsets, matrix.shape[0] - 1)
+    other_histograms = get_token_histograms(other_tokens, other_offsets, matrix.shape[0] - 1)
+    chunk_count = min(pair_count, thread_count * CHUNKS_PER_THREAD)
+    for chunk in prange(chunk_count):
+        start = chunk * pair_count // chunk_count
+        end = (chunk + 1) * pair_count // chunk_count
+        previous_row = np.zeros(max_length, dtype=np.int64)
+        current_row = np.zeros(max_length, dtype=np.int64)
+        for p in range(start, end):
+            i, j = pairs[p, 0], pairs[p, 1]
+            similarity_scores[p] = get_bounded_similarity(
+                tokens[offsets[i] : offsets[i + 1]],
+                other_tokens[other_offsets[j] : other_offsets[j + 1]],
+                histograms[i],
+                other_histograms[j],
+                matrix,
+                self_similarities[i] + other_self_similarities[j],
+                band,
+                previous_row,
+                current_row,
+                min_score,
             )
-            dp[i, j] = maxScore
-    return dp[-1, -1] * 2 / self_similarity_sum
+    return similarity_scores
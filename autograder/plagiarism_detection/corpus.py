@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from .token_cache import SEPARATOR_TOKEN, TOKEN_DTYPE
+
+L = logging.getLogger("AUTOGRADER.plagiarism_detection.corpus")
+
+CORPUS_VERSION = 2
+TOKENS_FILE_NAME = "tokens.bin"
+OFFSETS_FILE_NAME = "offsets.bin"
+ENTRIES_FILE_NAME = "entries.jsonl"
+INDEX_FILE_NAME = "index.json"
+OFFSET_DTYPE = np.int64
+
+
+class CorpusSection(NamedTuple):
+    """Token streams of a single language stored back to back.
+
+    The token stream of entry k is tokens[offsets[k] : offsets[k + 1]].
+    Entries are identified by their name together with the hash of their contents
+    so that submissions with the same name from different semesters never get mixed up.
+    token_counts is the number of occurrences of every token type within the whole section.
+    """
+
+    names: List[str]
+    hashes: List[str]
+    tokens: np.ndarray
+    offsets: np.ndarray
+    token_counts: np.ndarray
+
+    def get_stream(self, index: int) -> np.ndarray:
+        return self.tokens[self.offsets[index] : self.offsets[index + 1]]
+
+
+class Corpus:
+    """A persistent store of the token streams of submissions from previous semesters.
+
+    Every language is kept in its own subdirectory as flat binary files of tokens and of offsets
+    which get memory-mapped on load so opening even a huge corpus doesn't copy or re-lex anything.
+    New submissions are appended to these files and only become visible once the small index file
+    that records the number of entries is replaced so an interrupted add never corrupts the corpus.
+    """
+
+    directory: Path
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def get(self, language: str) -> Optional[CorpusSection]:
+        """Returns None if the corpus has no submissions in the language"""
+        section_dir = self.directory / language
+        index = self._read_index(section_dir)
+        if index is None:
+            return None
+        entries = self._read_entries(section_dir, index)
+        offsets = load_array(section_dir / OFFSETS_FILE_NAME, OFFSET_DTYPE, index["count"] + 1)
+        return CorpusSection(
+            [entry["name"] for entry in entries],
+            [entry["hash"] for entry in entries],
+            load_array(section_dir / TOKENS_FILE_NAME, TOKEN_DTYPE, int(offsets[-1])),
+            offsets,
+            np.array(index["token_counts"], dtype=np.int64),
+        )
+
+    def add(
+        self,
+        language: str,
+        names: List[str],
+        hashes: List[str],
+        token_streams: List[np.ndarray],
+        token_type_count: int,
+    ) -> None:
+        """Appends the token streams to the corpus.
+        Entries that are already in the corpus (with the same name and hash) are skipped
+        """
+        section_dir = self.directory / language
+        index = self._read_index(section_dir)
+        if index is None:
+            index = {"version": CORPUS_VERSION, "count": 0, "entries_size": 0, "tokens_size": 0}
+            index["token_counts"] = [0] * token_type_count
+            existing_entries = set()
+        else:
+            existing_entries = {(e["name"], e["hash"]) for e in self._read_entries(section_dir, index)}
+        new_entries, new_streams = [], []
+        for name, hash_, stream in zip(names, hashes, token_streams):
+            if (name, hash_) in existing_entries:
+                L.warning(f"'{name}' is already in the plagiarism corpus. Skipping it.")
+            else:
+                existing_entries.add((name, hash_))
+                new_entries.append({"name": name, "hash": hash_})
+                new_streams.append(stream.astype(TOKEN_DTYPE))
+        if not new_entries:
+            return
+        new_tokens = np.concatenate(new_streams)
+        lengths = np.array([len(s) for s in new_streams], dtype=OFFSET_DTYPE)
+        offsets = index["tokens_size"] + np.cumsum(lengths)
+        if index["count"] == 0:
+            offsets = np.concatenate(([0], offsets)).astype(OFFSET_DTYPE)
+        entries = "".join(json.dumps(entry) + "\n" for entry in new_entries).encode()
+        section_dir.mkdir(parents=True, exist_ok=True)
+        # Anything past the sizes recorded in the index is left over from an interrupted add so it gets overwritten
+        committed_offsets = (index["count"] + 1) * OFFSET_DTYPE().itemsize if index["count"] else 0
+        for file_name, committed_size, data in (
+            (TOKENS_FILE_NAME, index["tokens_size"] * TOKEN_DTYPE().itemsize, new_tokens.tobytes()),
+            (OFFSETS_FILE_NAME, committed_offsets, offsets.tobytes()),
+            (ENTRIES_FILE_NAME, index["entries_size"], entries),
+        ):
+            with (section_dir / file_name).open("ab") as f:
+                f.truncate(committed_size)
+                f.write(data)
+        index["count"] += len(new_entries)
+        index["entries_size"] += len(entries)
+        index["tokens_size"] += int(lengths.sum())
+        new_token_counts = np.bincount(new_tokens, minlength=token_type_count)
+        # Separators are not code so they must not affect the frequencies of the real tokens
+        new_token_counts[SEPARATOR_TOKEN] = 0
+        index["token_counts"] = (np.array(index["token_counts"], dtype=np.int64) + new_token_counts).tolist()
+        temporary_path = section_dir / f"{INDEX_FILE_NAME}.tmp"
+        temporary_path.write_text(json.dumps(index))
+        os.replace(temporary_path, section_dir / INDEX_FILE_NAME)
+
+    @staticmethod
+    def _read_index(section_dir: Path) -> Optional[dict]:
+        if not (section_dir / INDEX_FILE_NAME).is_file():
+            return None
+        index = json.loads((section_dir / INDEX_FILE_NAME).read_text())
+        if index["version"] != CORPUS_VERSION:
+            raise ValueError(f"Plagiarism corpus '{section_dir}' was created by an incompatible version of autograder")
+        return index
+
+    @staticmethod
+    def _read_entries(section_dir: Path, index: dict) -> List[dict]:
+        with (section_dir / ENTRIES_FILE_NAME).open("rb") as f:
+            return [json.loads(line) for line in f.read(index["entries_size"]).splitlines()]
+
+
+def load_array(path: Path, dtype: type, length: int) -> np.ndarray:
+    if length == 0:
+        return np.zeros(0, dtype=dtype)
+    # asarray turns the memory map into a regular array without copying it which is what numba expects
+    return np.asarray(np.memmap(path, dtype=dtype, mode="r", shape=(length,)))
@@ -0,0 +1,145 @@
+from typing import List, Optional
+
+import numpy as np
+from numba import njit
+
+# A match has to span at least KGRAM_SIZE + WINDOW_SIZE - 1 tokens to be guaranteed to share a fingerprint
+KGRAM_SIZE = 8
+WINDOW_SIZE = 4
+HASH_BASE = 1_000_003
+# Fingerprints found in more than this share of the files are most likely template code that was given to everyone.
+# In small classes, we can't tell template code apart from code shared by a few students so nothing is ignored there
+COMMON_FINGERPRINT_RATIO = 0.5
+MIN_COMMON_FINGERPRINT_FILE_COUNT = 20
+
+
+@njit(cache=True)
+def get_fingerprints(tokens: np.ndarray, kgram_size: int, window_size: int) -> np.ndarray:
+    """Winnows the hashes of all k-grams of tokens: the minimal hash of every window of window_size
+    consecutive k-grams is selected as a fingerprint. Returns the sorted unique fingerprints.
+
+    Token streams that are shorter than a single k-gram are hashed as a whole.
+    """
+    if len(tokens) == 0:
+        return np.zeros(0, dtype=np.int64)
+    kgram_size = min(kgram_size, len(tokens))
+    hashes = np.zeros(len(tokens) - kgram_size + 1, dtype=np.int64)
+    for start in range(len(hashes)):
+        h = 0
+        for token in tokens[start : start + kgram_size]:
+            # Overflow is intended: the hash wraps around 2 ** 64
+            h = h * HASH_BASE + token + 1
+        hashes[start] = h
+    window_size = min(window_size, len(hashes))
+    fingerprints = np.zeros(len(hashes) - window_size + 1, dtype=np.int64)
+    fingerprint_count = 0
+    previous_position = -1
+    for start in range(len(hashes) - window_size + 1):
+        # The rightmost minimal hash is selected so that consecutive windows keep selecting the same k-gram
+        position = start
+        for i in range(start + 1, start + window_size):
+            if hashes[i] <= hashes[position]:
+                position = i
+        if position != previous_position:
+            fingerprints[fingerprint_count] = hashes[position]
+            fingerprint_count += 1
+            previous_position = position
+    return np.unique(fingerprints[:fingerprint_count])
+
+
+@njit(cache=True)
+def count_shared_fingerprints(
+    fingerprints: np.ndarray, files: np.ndarray, file_count: int, max_file_count: int, query_count: int
+) -> np.ndarray:
+    """Walks an inverted index of fingerprints sorted by their value (and by file within the same value)
+    and counts the fingerprints shared by every pair of files that includes one of the first query_count files.
+    Fingerprints found in more than max_file_count files are ignored.
+
+    Returns an array of (i, j, shared fingerprint count) rows with i < j
+    """
+    # Each run of equal fingerprints is the posting list of that fingerprint
+    run_starts = [0]
+    for k in range(1, len(fingerprints)):
+        if fingerprints[k] != fingerprints[k - 1]:
+            run_starts.append(k)
+    run_starts.append(len(fingerprints))
+    pair_count = 0
+    for r in range(len(run_starts) - 1):
+        start, end = run_starts[r], run_starts[r + 1]
+        if end - start <= max_file_count:
+            for a in range(start, end):
+                if files[a] >= query_count:
+                    break
+                pair_count += end - a - 1
+    keys = np.zeros(pair_count, dtype=np.int64)
+    k = 0
+    for r in range(len(run_starts) - 1):
+        start, end = run_starts[r], run_starts[r + 1]
+        if end - start > max_file_count:
+            continue
+        for a in range(start, end):
+            # Pairs between the rest of the files are not needed
+            if files[a] >= query_count:
+                break
+            for b in range(a + 1, end):
+                i, j = min(files[a], files[b]), max(files[a], files[b])
+                keys[k] = i * file_count + j
+                k += 1
+    keys.sort()
+    shared = np.zeros((0, 3), dtype=np.int64)
+    if len(keys) == 0:
+        return shared
+    unique_count = 1
+    for k in range(1, len(keys)):
+        if keys[k] != keys[k - 1]:
+            unique_count += 1
+    shared = np.zeros((unique_count, 3), dtype=np.int64)
+    row = 0
+    for k in range(len(keys)):
+        if k > 0 and keys[k] != keys[k - 1]:
+            row += 1
+        shared[row, 0] = keys[k] // file_count
+        shared[row, 1] = keys[k] % file_count
+        shared[row, 2] += 1
+    return shared
+
+
+def get_candidate_pairs(
+    token_streams: List[np.ndarray], min_overlap: float, top: int, query_count: Optional[int] = None
+) -> np.ndarray:
+    """Finds the pairs of files that are worth aligning based on the fingerprints that they share.
+    If query_count is set, only the pairs that include one of the first query_count files are considered.
+
+    The overlap of a pair is the share of the fingerprints of the smaller file that are also found in the larger one.
+    A pair is a candidate if its overlap is at least min_overlap (if min_overlap > 0)
+    or if it is among the top pairs by overlap of either of its files (if top > 0).
+    Returns an array of (i, j) rows with i < j
+    """
+    file_count = len(token_streams)
+    query_count = file_count if query_count is None else query_count
+    fingerprints = [get_fingerprints(stream, KGRAM_SIZE, WINDOW_SIZE) for stream in token_streams]
+    fingerprint_counts = np.array([len(f) for f in fingerprints], dtype=np.int64)
+    if fingerprint_counts.sum() == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    # The inverted index from fingerprint to the files that contain it is kept as a single sorted array
+    all_fingerprints = np.concatenate(fingerprints)
+    all_files = np.repeat(np.arange(file_count, dtype=np.int64), fingerprint_counts)
+    order = np.argsort(all_fingerprints, kind="stable")
+    max_file_count = max(MIN_COMMON_FINGERPRINT_FILE_COUNT, int(COMMON_FINGERPRINT_RATIO * file_count))
+    shared = count_shared_fingerprints(
+        all_fingerprints[order], all_files[order], file_count, max_file_count, query_count
+    )
+    i, j, shared_count = shared[:, 0], shared[:, 1], shared[:, 2]
+    overlap = shared_count / np.maximum(np.minimum(fingerprint_counts[i], fingerprint_counts[j]), 1)
+
+    is_candidate = overlap >= min_overlap if min_overlap > 0 else np.zeros(len(shared), dtype=bool)
+    if top > 0:
+        # Every pair is ranked twice: once among the pairs of i and once among the pairs of j
+        files = np.concatenate((i, j))
+        pair_indices = np.concatenate((np.arange(len(shared)), np.arange(len(shared))))
+        order = np.lexsort((-np.concatenate((overlap, overlap)), files))
+        files, pair_indices = files[order], pair_indices[order]
+        group_starts = np.flatnonzero(np.r_[True, files[1:] != files[:-1]])
+        ranks = np.arange(len(files)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(files)]))
+        is_candidate[pair_indices[ranks < top]] = True
+    return shared[is_candidate, :2]
@@ -1,42 +1,229 @@
-import math
-from pathlib import Path
-from typing import List
+import contextlib
+import heapq
+import importlib
+import logging
+import os
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
+import numba
 import numpy as np
-from antlr4 import CommonTokenStream, InputStream
+from antlr4 import InputStream, Token
 
-from .comparison import get_similarity
-from .lexers.CLexer import CLexer
-from .lexers.CppLexer import CppLexer
-from .lexers.Java8Lexer import JavaLexer
-from .lexers.Python3Lexer import Python3Lexer
+from ..util import get_path_hash
+from .comparison import get_all_similarities, get_pair_similarities
+from .corpus import Corpus, CorpusSection
+from .fingerprints import get_candidate_pairs
+from .token_cache import SEPARATOR_TOKEN, TOKEN_DTYPE, TOKEN_TYPECODE, TokenCache
+
+L = logging.getLogger("AUTOGRADER.plagiarism_detection")
+
+# Every lexing process gets several batches of files to even out the differences in file sizes
+LEXING_BATCHES_PER_WORKER = 4
+# The submissions are compared to the corpus in chunks of about this many pairs so that
+# the pairs and the scores of a huge corpus never have to be kept all at once
+CORPUS_PAIRS_PER_CHUNK = 1 << 20
+
+
+class Match(NamedTuple):
+    score: float
+    # The most similar source files of the directory submissions of the pair
+    files: Dict[Path, Path] = {}
 
 
 # entry point function that is called to compare a set of files with each other
-def compare(paths: List[Path]) -> dict:
+def compare(
+    paths: List[Path],
+    band: int = 0,
+    jobs: int = 0,
+    min_overlap: float = 0.0,
+    top_overlap: int = 0,
+    corpus: Optional[Corpus] = None,
+    add_to_corpus: bool = False,
+    token_cache: Optional[TokenCache] = None,
+    max_tokens: int = 0,
+    top: int = 0,
+    min_score: float = 0.0,
+) -> dict:
+    """band > 0 only aligns the tokens that are at most band tokens away from the diagonal
+    which is faster for long files but can miss code that has been moved around.
+    jobs is the number of processes used for lexing and of threads used for comparisons (0 means all cores).
+
+    If min_overlap > 0 or top_overlap > 0, only the pairs that share enough winnowed fingerprints get aligned
+    (see fingerprints.get_candidate_pairs) and the rest of the pairs are left out of the results.
+
+    If corpus is set, the files are also compared to the submissions from the corpus which are returned
+    as PurePosixPath("<directory name>/<file name>") (followed by "@<content hash>" if several of them share the name).
+    Token frequencies of the corpus are taken into account as well.
+    add_to_corpus stores the files in the corpus under such names after the comparison. Files that are already
+    in the corpus under the same name and with the same contents are neither added again nor compared to themselves.
+
+    Directory submissions (e.g. multi-file projects with a makefile) are compared as a single file
+    made of all of their source files. Their matches also include the source files that were the most similar.
+
+    If token_cache is set, the files that have been lexed before are not lexed again.
+    max_tokens > 0 only compares the first max_tokens tokens of every submission.
+
+    Only the pairs whose score is at least min_score are returned. If top > 0, only the top most similar
+    pairs across all languages are. Both are applied while comparing so the scores of the rest of the pairs are never kept.
+    Files of unsupported languages are skipped. Returns the Match of every pair for every language separately
+    """
+    results: Dict[str, dict] = {}
+    for language, pair, match in iterate_matches(
+        paths,
+        band,
+        jobs,
+        min_overlap,
+        top_overlap,
+        corpus,
+        add_to_corpus,
+        token_cache,
+        max_tokens,
+        top,
+        min_score,
+    ):
+        results.setdefault(language, {})[pair] = match
+    return results
+
+
+def iterate_matches(
+    paths: List[Path],
+    band: int = 0,
+    jobs: int = 0,
+    min_overlap: float = 0.0,
+    top_overlap: int = 0,
+    corpus: Optional[Corpus] = None,
+    add_to_corpus: bool = False,
+    token_cache: Optional[TokenCache] = None,
+    max_tokens: int = 0,
+    top: int = 0,
+    min_score: float = 0.0,
+) -> Iterator[Tuple[str, frozenset, Match]]:
+    """Same as compare but yields (language, pair, match) tuples as soon as every language has been compared
+    so the matches never have to be kept all at once. They are sorted (the most similar first) only if top > 0,
+    in which case at most top of them are kept at a time.
+    """
+    matches = iterate_language_matches(
+        paths, band, jobs, min_overlap, top_overlap, corpus, add_to_corpus, token_cache, max_tokens, top, min_score
+    )
+    if top > 0:
+        yield from heapq.nlargest(top, matches, key=lambda m: m[2].score)
+    else:
+        yield from matches
+
+
+def iterate_language_matches(
+    paths: List[Path],
+    band: int,
+    jobs: int,
+    min_overlap: float,
+    top_overlap: int,
+    corpus: Optional[Corpus],
+    add_to_corpus: bool,
+    token_cache: Optional[TokenCache],
+    max_tokens: int,
+    top: int,
+    min_score: float,
+) -> Iterator[Tuple[str, frozenset, Match]]:
     numFiles = len(paths)
     if numFiles == 0:
         raise ValueError("No files found")
-    language_map = initialize_language(paths)
-    results = {}
-    for language in language_map:
+    language_map = {name: language for name, language in initialize_language(paths).items() if language["files"]}
+    # Files of all languages are lexed together so that a small language doesn't leave most of the workers idle
+    all_token_streams = get_token_streams(list(language_map.values()), token_cache, jobs)
+    for language, source_file_streams in zip(language_map, all_token_streams):
         files = language_map[language]["files"]
-        if len(files) == 0:
-            continue
+        source_files = language_map[language]["source_files"]
+        token_streams = join_source_files(source_file_streams, [len(f) for f in source_files])
         # get token stream for each file and total frequency for each token type
-        parsed_file_map = parse_files(language_map[language])
-        token_streams = parsed_file_map["token_streams"]
-        lengths = parsed_file_map["lengths"]
+        parsed_file_map = build_parsed_file_map(token_streams, language_map[language]["num_tokens"], max_tokens)
+        tokens, offsets = parsed_file_map["tokens"], parsed_file_map["offsets"]
+        streams = [tokens[offsets[i] : offsets[i + 1]] for i in range(len(files))]
+        freq = parsed_file_map["freq"]
+        corpus_section = corpus.get(language) if corpus is not None else None
+        if corpus is not None:
+            corpus_entries = [(get_corpus_name(f), get_path_hash(f)) for f in files]
+        if corpus_section is not None:
+            freq = get_token_frequencies(parsed_file_map["token_counts"] + corpus_section.token_counts)
+            # The files that have been added to the corpus before must not be matched with their own copies.
+            # Names alone are not enough because every semester has the same directories (e.g. hw1/)
+            excluded_entries = set(corpus_entries)
+            excluded_indices = {
+                k
+                for k, entry in enumerate(zip(corpus_section.names, corpus_section.hashes))
+                if entry in excluded_entries
+            }
         # construct similarity matrix to weight the significance of matching tokens. Matching uncommon tokens
         # is weighted heavier as it is more likely to be a result of plagiarism
-        similarityMatrix = build_similarity_matrix(parsed_file_map["freq"])
+        similarityMatrix = build_similarity_matrix(freq)
         # find the similarity score of comparing a file to itself. This is used to normalize the similarity score
         # calculated when comparing unique files
-        self_similarities = build_self_similarities(token_streams, similarityMatrix, lengths)
-        result = run_comparisons(token_streams, similarityMatrix, self_similarities, lengths)
-        results[language] = convert_results(result, files)
-
-    return results
+        self_similarities = build_self_similarities(tokens, offsets, similarityMatrix)
+        if min_overlap > 0 or top_overlap > 0:
+            if corpus_section is not None:
+                corpus_indices = np.array(
+                    [k for k in range(len(corpus_section.names)) if k not in excluded_indices], dtype=np.int64
+                )
+                corpus_streams = [corpus_section.get_stream(k) for k in corpus_indices]
+            else:
+                corpus_indices, corpus_streams = np.zeros(0, dtype=np.int64), []
+            pairs = get_candidate_pairs(streams + corpus_streams, min_overlap, top_overlap, len(files))
+            is_corpus_pair = pairs[:, 1] >= len(files)
+            corpus_pairs = np.stack(
+                (pairs[is_corpus_pair, 0], corpus_indices[pairs[is_corpus_pair, 1] - len(files)]), 1
+            )
+            pairs = pairs[~is_corpus_pair]
+            scores = run_candidate_comparisons(
+                tokens, offsets, similarityMatrix, self_similarities, pairs, band, jobs, min_score
+            )
+            pairs, scores = select_most_similar(pairs, scores, top, min_score)
+            if corpus_section is not None:
+                corpus_scores = run_corpus_comparisons(
+                    tokens,
+                    offsets,
+                    similarityMatrix,
+                    self_similarities,
+                    corpus_section.tokens,
+                    corpus_section.offsets,
+                    corpus_pairs,
+                    band,
+                    jobs,
+                    min_score,
+                )
+                corpus_results = [select_most_similar(corpus_pairs, corpus_scores, top, min_score)]
+        else:
+            if corpus_section is not None:
+                corpus_results = iterate_corpus_comparisons(
+                    tokens,
+                    offsets,
+                    similarityMatrix,
+                    self_similarities,
+                    corpus_section,
+                    excluded_indices,
+                    band,
+                    jobs,
+                    top,
+                    min_score,
+                )
+            pairs, scores = run_comparisons(
+                tokens, offsets, similarityMatrix, self_similarities, band, jobs, top, min_score
+            )
+        matching_files = get_matching_source_files(
+            pairs, files, source_files, source_file_streams, similarityMatrix, band, jobs, max_tokens
+        )
+        for pair, match in convert_results(scores, pairs, files, matching_files):
+            yield language, pair, match
+        if corpus_section is not None:
+            corpus_result_names = get_corpus_result_names(corpus_section)
+            for corpus_pairs, scores in corpus_results:
+                for pair, match in convert_corpus_results(scores, corpus_pairs, files, corpus_result_names):
+                    yield language, pair, match
+        if corpus is not None and add_to_corpus:
+            names, hashes = zip(*corpus_entries)
+            corpus.add(language, list(names), list(hashes), streams, len(parsed_file_map["token_counts"]))
 
 
 # determine language of files and initialize language-specific variables
@@ -44,28 +231,32 @@ def initialize_language(paths: List[Path]) -> dict:
     language_partition = {"java": [], "py": [], "c": [], "cpp": []}
 
     for path in paths:
-        language_partition[path.suffix.split(".")[-1]].append(path)
+        suffix = get_submission_suffix(path, list(language_partition))
+        if suffix is not None:
+            language_partition[suffix].append(path)
+        else:
+            L.warning(f"Skipping '{path}' because plagiarism detection does not support its language")
 
-    # format: "file ending": [Lexer class used to parse, [ignore list of token types to ignore when parsing],
-    # number of unique tokens in language]
+    # format: "file ending": [module and name of the Lexer class used to parse,
+    # [ignore list of token types to ignore when parsing], number of unique tokens in language]
     language_mapper = {
         "java": {
-            "lexer": JavaLexer,
+            "lexer_path": ("Java8Lexer", "JavaLexer"),
             "ignore_list": np.array([-1, 106, 107]),
             "num_tokens": 108,
         },
         "py": {
-            "lexer": Python3Lexer,
+            "lexer_path": ("Python3Lexer", "Python3Lexer"),
             "ignore_list": np.array([-1, 39]),
             "num_tokens": 99,
         },
         "c": {
-            "lexer": CLexer,
+            "lexer_path": ("CLexer", "CLexer"),
             "ignore_list": np.array([-1, 117, 118]),
             "num_tokens": 119,
         },
         "cpp": {
-            "lexer": CppLexer,
+            "lexer_path": ("CppLexer", "CppLexer"),
             "ignore_list": np.array([-1, 144, 145]),
             "num_tokens": 146,
         },
@@ -73,111 +264,407 @@ def initialize_language(paths: List[Path]) -> dict:
     # add files of each programming language to mapper object
     for key in language_mapper:
         language_mapper[key]["files"] = language_partition[key]
+        language_mapper[key]["source_files"] = [get_source_files(path, key) for path in language_partition[key]]
+        # Generated lexers take a while to import so we only import the ones that are going to be used
+        language_mapper[key]["lexer"] = (
+            get_lexer_class(*language_mapper[key]["lexer_path"]) if language_partition[key] else None
+        )
     return language_mapper
 
 
-def parse_files(language: dict) -> dict:
-    files = language["files"]
-    lexer_class = language["lexer"]
-    ignore_list = language["ignore_list"]
-    num_tokens = language["num_tokens"]
-    tokenStreams = []
-    freq = [0 for x in range(num_tokens + 1)]
-    total_tokens = 0
-    for file in files:
-        with file.open() as f:
-            stream = InputStream(f.read())
-            lexer = lexer_class(stream)
-            tokens = CommonTokenStream(lexer)
-            # TODO: look at fetch
-            tokens.fetch(5000)
-            array = []
-            for token in tokens.tokens:
-                # remove comments, blank lines, etc
-                if token.type > num_tokens:
-                    pass
-                if token.type not in ignore_list and token.type <= num_tokens:
-                    array += [token.type]
-                    freq[token.type] += 1
-                    total_tokens += 1
-            tokenStreams += [np.array(array)]
-    # find frequency of each token as percentage of total tokens
-    if total_tokens == 0:
-        freq = [1e-10 for x in range(len(freq))]
-    else:
-        for i in range(len(freq)):
-            freq[i] = max(freq[i] / total_tokens, 1e-10)  # type: ignore
-    lengths = np.array([len(x) for x in tokenStreams])
-    converted_token_stream = np.zeros((len(tokenStreams), np.max(lengths)), np.int32)
-    for i in range(len(tokenStreams)):
-        converted_token_stream[i, : lengths[i]] = tokenStreams[i]
+def get_lexer_class(module_name: str, class_name: str) -> type:
+    return getattr(importlib.import_module(f".lexers.{module_name}", __package__), class_name)
+
+
+def get_submission_suffix(path: Path, suffixes: List[str]) -> Optional[str]:
+    """The language of a directory submission is the one that most of its source files are written in"""
+    if path.is_dir():
+        file_suffixes = [f.suffix.split(".")[-1] for f in path.rglob("*") if f.is_file()]
+        counts = {suffix: file_suffixes.count(suffix) for suffix in suffixes}
+        suffix = max(suffixes, key=counts.__getitem__)
+        return suffix if counts[suffix] > 0 else None
+    suffix = path.suffix.split(".")[-1]
+    return suffix if suffix in suffixes else None
+
+
+def get_source_files(path: Path, suffix: str) -> List[Path]:
+    if not path.is_dir():
+        return [path]
+    # Sorting by the relative paths keeps the order the same on every system and for every location of the submission
+    source_files = [f for f in path.rglob(f"*.{suffix}") if f.is_file()]
+    return sorted(source_files, key=lambda f: f.relative_to(path).as_posix())
+
+
+def parse_files(language: dict, token_cache: Optional[TokenCache] = None, jobs: int = 0, max_tokens: int = 0) -> dict:
+    """If token_cache is set, only the files that are not in it yet get lexed.
+    jobs is the number of processes used for lexing (0 means all cores).
+    max_tokens > 0 only keeps the first max_tokens tokens of every file
+    """
+    source_file_streams = get_token_streams([language], token_cache, jobs)[0]
+    token_streams = join_source_files(source_file_streams, [len(f) for f in language["source_files"]])
+    return build_parsed_file_map(token_streams, language["num_tokens"], max_tokens)
+
+
+def get_token_streams(
+    languages: List[dict], token_cache: Optional[TokenCache] = None, jobs: int = 0
+) -> List[List[np.ndarray]]:
+    """Returns the token streams of the source files of every language in the order of their submissions.
+    The files that are not in token_cache yet are lexed in a single pool of processes regardless of their language
+    """
+    source_files = [[f for files in language["source_files"] for f in files] for language in languages]
+    token_streams: List[List[Optional[np.ndarray]]] = [[None for _ in files] for files in source_files]
+    keys: Dict[Tuple[int, int], str] = {}
+    missing: List[Tuple[int, int]] = []
+    for language_index, language in enumerate(languages):
+        for file_index, file in enumerate(source_files[language_index]):
+            if token_cache is not None:
+                key = token_cache.make_key(
+                    file.read_bytes(), language["lexer"], language["ignore_list"], language["num_tokens"]
+                )
+                keys[language_index, file_index] = key
+                token_streams[language_index][file_index] = token_cache.load(key)
+            if token_streams[language_index][file_index] is None:
+                missing.append((language_index, file_index))
+    lexed = tokenize_files([source_files[l][f] for l, f in missing], [languages[l] for l, _ in missing], jobs)
+    for (language_index, file_index), tokens in zip(missing, lexed):
+        token_streams[language_index][file_index] = tokens
+        if token_cache is not None:
+            token_cache.store(keys[language_index, file_index], tokens)
+    return token_streams  # type: ignore
+
+
+def join_source_files(source_file_streams: List[np.ndarray], source_file_counts: List[int]) -> List[np.ndarray]:
+    """Concatenates the token streams of the source files of every submission with SEPARATOR_TOKEN between them"""
+    separator = np.array([SEPARATOR_TOKEN], dtype=TOKEN_DTYPE)
+    token_streams = []
+    start = 0
+    for count in source_file_counts:
+        streams = source_file_streams[start : start + count]
+        if count == 1:
+            token_streams.append(streams[0])
+        else:
+            token_streams.append(np.concatenate([part for stream in streams for part in (separator, stream)][1:]))
+        start += count
+    return token_streams
+
+
+def build_parsed_file_map(token_streams: List[np.ndarray], num_tokens: int, max_tokens: int = 0) -> dict:
+    if max_tokens > 0:
+        # The cache keeps whole files so that they don't have to be lexed again when the limit changes
+        token_streams = [tokens[:max_tokens] for tokens in token_streams]
+    # Token frequencies are summed up from the counts of every file
+    freq = np.zeros(num_tokens + 1, dtype=np.int64)
+    for tokens in token_streams:
+        freq += np.bincount(tokens, minlength=num_tokens + 1)
+    # Separators are not code so they must not affect the frequencies of the real tokens
+    freq[SEPARATOR_TOKEN] = 0
+    lengths = np.array([len(x) for x in token_streams], dtype=np.int64)
+    # Token streams are stored back to back (the token stream of file i is tokens[offsets[i] : offsets[i + 1]])
+    # so memory depends on the total number of tokens instead of the number of files times the longest file
+    tokens = np.concatenate(token_streams).astype(np.min_scalar_type(num_tokens))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
     return {
-        "token_streams": converted_token_stream,
-        "freq": np.array(freq),
+        "tokens": tokens,
+        "offsets": offsets,
+        "freq": get_token_frequencies(freq),
+        "token_counts": freq,
         "lengths": lengths,
     }
 
 
+def tokenize_files(files: List[Path], languages: List[dict], jobs: int = 0) -> List[np.ndarray]:
+    """languages[k] is the language of files[k]"""
+    lexing_args = (
+        [language["lexer"] for language in languages],
+        [language["ignore_list"] for language in languages],
+        [language["num_tokens"] for language in languages],
+    )
+    # antlr lexers are pure python so the only way to lex several files at once is to use several processes
+    workers = min(jobs or os.cpu_count() or 1, len(files))
+    if workers <= 1:
+        return list(map(tokenize_file, files, *lexing_args))
+    with ProcessPoolExecutor(workers) as executor:
+        # Sending files in batches amortizes the cost of passing the arguments and results between processes
+        chunksize = max(1, len(files) // (workers * LEXING_BATCHES_PER_WORKER))
+        return list(executor.map(tokenize_file, files, *lexing_args, chunksize=chunksize))
+
+
+def tokenize_file(file: Path, lexer_class: type, ignore_list: np.ndarray, num_tokens: int) -> np.ndarray:
+    with file.open() as f:
+        lexer = lexer_class(InputStream(f.read()))
+    # Token types are collected into a compact growable buffer instead of a list of python objects
+    token_types = array(TOKEN_TYPECODE)
+    token = lexer.nextToken()
+    while token.type != Token.EOF:
+        token_types.append(token.type)
+        token = lexer.nextToken()
+    tokens = np.frombuffer(token_types, dtype=TOKEN_DTYPE)
+    # remove comments, blank lines, etc
+    return tokens[(tokens <= num_tokens) & ~np.isin(tokens, ignore_list)]
+
+
+def get_token_frequencies(token_counts: np.ndarray) -> np.ndarray:
+    # find frequency of each token as percentage of total tokens
+    total_tokens = token_counts.sum()
+    if total_tokens == 0:
+        return np.full(len(token_counts), 1e-10)
+    return np.maximum(token_counts / total_tokens, 1e-10)
+
+
 def build_similarity_matrix(freq: np.ndarray) -> np.ndarray:
     # alpha is how heavily matching tokens should be penalized, beta is how heavily
     # mismatching tokens should be rewarded. alpha + beta = 1
     alpha = 0.65
     beta = 0.35
     matrixLen = len(freq) + 1
-    matrix = np.zeros((matrixLen, matrixLen))
-    for i in range(matrixLen):
-        for j in range(i, matrixLen):
-            # matching a gap with a gap is impossible
-            if i == matrixLen - 1 and j == matrixLen - 1:
-                value = 1e10
-            # value of matching token i with a gap
-            elif j == matrixLen - 1:
-                value = 4 * beta * math.log2(freq[i])
-            # value of matching token i
-            elif i == j:
-                value = -1 * alpha * math.log2(freq[i] * freq[i])
-            # value of matching two different tokens, i and j
-            else:
-                value = beta * math.log2(freq[i] * freq[j])
-            # value of matching i and j is same as matching j and i
-            matrix[i, j] = int(1000 * value)
-            matrix[j, i] = int(1000 * value)
-    return np.array(matrix)
+    # value of matching i and j is same as matching j and i so the matrix is built from symmetric parts
+    log_products = np.log2(np.multiply.outer(freq, freq))
+    values = np.empty((matrixLen, matrixLen))
+    # value of matching two different tokens, i and j
+    values[:-1, :-1] = beta * log_products
+    # value of matching token i
+    np.fill_diagonal(values[:-1, :-1], -1 * alpha * np.diag(log_products))
+    # value of matching token i with a gap
+    values[:-1, -1] = values[-1, :-1] = 4 * beta * np.log2(freq)
+    # matching a gap with a gap is impossible
+    values[-1, -1] = 1e10
+    # separators never add to the score: matching them is the same as skipping the other token and skipping them is free
+    values[SEPARATOR_TOKEN, :-1] = values[:-1, SEPARATOR_TOKEN] = values[-1, :-1]
+    values[SEPARATOR_TOKEN, SEPARATOR_TOKEN] = values[SEPARATOR_TOKEN, -1] = values[-1, SEPARATOR_TOKEN] = 0
+    # All values are truncated to integers so we can use integer arithmetic in the alignment kernel
+    return (1000 * values).astype(np.int64)
 
 
-def build_self_similarities(token_streams: np.ndarray, matrix: np.ndarray, lengths: np.ndarray) -> np.ndarray:
-    self_similarities = []
-    for i in range(len(token_streams)):
-        score = 0
-        # for each token, find value of matching that token with itself and add to sum
-        for tok in token_streams[i, : lengths[i]]:
-            score += matrix[int(tok), int(tok)]
-        self_similarities.append(score)
-    return np.array(self_similarities, dtype=np.int32)
+def build_self_similarities(tokens: np.ndarray, offsets: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    # for each token, find value of matching that token with itself and add to sum.
+    # Cumulative sums allow us to sum up the tokens of all files at once without splitting them
+    cumulative_sums = np.concatenate(([0], np.cumsum(np.diag(matrix)[tokens])))
+    return cumulative_sums[offsets[1:]] - cumulative_sums[offsets[:-1]]
 
 
 def run_comparisons(
-    token_streams: np.ndarray,
+    tokens: np.ndarray,
+    offsets: np.ndarray,
+    similarity_matrix: np.ndarray,
+    self_similarities: np.ndarray,
+    band: int = 0,
+    jobs: int = 0,
+    top: int = 0,
+    min_score: float = 0.0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    with limit_threads(jobs):
+        return get_all_similarities(
+            tokens, offsets, similarity_matrix, self_similarities, band, top, min_score, numba.get_num_threads()
+        )
+
+
+def run_candidate_comparisons(
+    tokens: np.ndarray,
+    offsets: np.ndarray,
+    similarity_matrix: np.ndarray,
+    self_similarities: np.ndarray,
+    pairs: np.ndarray,
+    band: int = 0,
+    jobs: int = 0,
+    min_score: float = 0.0,
+) -> np.ndarray:
+    with limit_threads(jobs):
+        return get_pair_similarities(
+            tokens,
+            offsets,
+            tokens,
+            offsets,
+            similarity_matrix,
+            self_similarities,
+            self_similarities,
+            band,
+            pairs,
+            min_score,
+            numba.get_num_threads(),
+        )
+
+
+def run_corpus_comparisons(
+    tokens: np.ndarray,
+    offsets: np.ndarray,
     similarity_matrix: np.ndarray,
     self_similarities: np.ndarray,
-    lengths: np.ndarray,
+    corpus_tokens: np.ndarray,
+    corpus_offsets: np.ndarray,
+    pairs: np.ndarray,
+    band: int = 0,
+    jobs: int = 0,
+    min_score: float = 0.0,
 ) -> np.ndarray:
-    similarity_scores = np.zeros((len(token_streams), len(token_streams)))
-    for i in range(len(token_streams)):
-        for j in range(i + 1, len(token_streams)):
-            similarity = get_similarity(
-                token_streams[i, : lengths[i]],
-                token_streams[j, : lengths[j]],
-                similarity_matrix,
-                self_similarities[i] + self_similarities[j],
+    with limit_threads(jobs):
+        return get_pair_similarities(
+            tokens,
+            offsets,
+            corpus_tokens,
+            corpus_offsets,
+            similarity_matrix,
+            self_similarities,
+            build_self_similarities(corpus_tokens, corpus_offsets, similarity_matrix),
+            band,
+            pairs,
+            min_score,
+            numba.get_num_threads(),
+        )
+
+
+def iterate_corpus_comparisons(
+    tokens: np.ndarray,
+    offsets: np.ndarray,
+    similarity_matrix: np.ndarray,
+    self_similarities: np.ndarray,
+    corpus_section: CorpusSection,
+    excluded_indices: Set[int],
+    band: int = 0,
+    jobs: int = 0,
+    top: int = 0,
+    min_score: float = 0.0,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Compares every file to every corpus entry except for the excluded ones, about CORPUS_PAIRS_PER_CHUNK pairs
+    at a time, and yields the (pairs, scores) of every chunk. If top > 0, only the top pairs of all chunks
+    are yielded at the end instead
+    """
+    file_count = len(offsets) - 1
+    entries_per_chunk = max(1, CORPUS_PAIRS_PER_CHUNK // max(file_count, 1))
+    best_pairs, best_scores = np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+    for start in range(0, len(corpus_section.names), entries_per_chunk):
+        end = min(start + entries_per_chunk, len(corpus_section.names))
+        indices = np.array([k - start for k in range(start, end) if k not in excluded_indices], dtype=np.int64)
+        if len(indices) == 0:
+            continue
+        pairs = np.stack(np.meshgrid(np.arange(file_count), indices, indexing="ij"), 2).reshape(-1, 2)
+        chunk_offsets = corpus_section.offsets[start : end + 1]
+        scores = run_corpus_comparisons(
+            tokens,
+            offsets,
+            similarity_matrix,
+            self_similarities,
+            corpus_section.tokens[chunk_offsets[0] : chunk_offsets[-1]],
+            chunk_offsets - chunk_offsets[0],
+            pairs,
+            band,
+            jobs,
+            min_score,
+        )
+        pairs[:, 1] += start
+        pairs, scores = select_most_similar(pairs, scores, top, min_score)
+        if top > 0:
+            best_pairs, best_scores = select_most_similar(
+                np.concatenate((best_pairs, pairs)), np.concatenate((best_scores, scores)), top, min_score
             )
-            similarity_scores[i, j] = similarity
-    return similarity_scores
+        else:
+            yield pairs, scores
+    if top > 0:
+        yield best_pairs, best_scores
+
+
+@contextlib.contextmanager
+def limit_threads(jobs: int) -> Iterator[None]:
+    """Runs the comparison kernels in at most jobs threads (0 means all cores)"""
+    previous_threading_layer = numba.config.THREADING_LAYER
+    # TBB makes the interpreter hang at exit if the process forks after a parallel comparison
+    # (e.g. to run testcases with resource limits) so we prefer the bundled thread pool unless asked otherwise.
+    # numba picks the layer once, when threads are first needed, so the setting is only kept for that moment
+    if previous_threading_layer == "default":
+        numba.config.THREADING_LAYER = "workqueue"
+    try:
+        previous_thread_count = numba.get_num_threads()
+        # numba can't start more threads than it has been configured with on startup
+        numba.set_num_threads(min(jobs, numba.config.NUMBA_NUM_THREADS) if jobs > 0 else numba.config.NUMBA_NUM_THREADS)
+        try:
+            yield
+        finally:
+            numba.set_num_threads(previous_thread_count)
+    finally:
+        numba.config.THREADING_LAYER = previous_threading_layer
+
+
+def select_most_similar(
+    pairs: np.ndarray, scores: np.ndarray, top: int, min_score: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    kept = np.flatnonzero(scores >= min_score)
+    if top > 0:
+        kept = kept[np.argsort(-scores[kept], kind="stable")[:top]]
+    return pairs[kept], scores[kept]
+
+
+def get_matching_source_files(
+    pairs: np.ndarray,
+    files: List[Path],
+    source_files: List[List[Path]],
+    source_file_streams: List[np.ndarray],
+    similarity_matrix: np.ndarray,
+    band: int = 0,
+    jobs: int = 0,
+    max_tokens: int = 0,
+) -> List[Dict[Path, Path]]:
+    """Aligns the source files of every pair that includes a directory submission with each other
+    to find the pair of source files that contributed the most to its score.
+    Returns these source files by their directory submission for every pair.
+    """
+    matching_files: List[Dict[Path, Path]] = [{} for _ in pairs]
+    starts = np.concatenate(([0], np.cumsum([len(f) for f in source_files])))
+    if max_tokens > 0:
+        source_file_streams = [tokens[:max_tokens] for tokens in source_file_streams]
+    offsets = np.concatenate(([0], np.cumsum([len(s) for s in source_file_streams])))
+    tokens = np.concatenate(source_file_streams).astype(np.min_scalar_type(similarity_matrix.shape[0] - 2))
+    self_similarities = build_self_similarities(tokens, offsets, similarity_matrix)
+    file_pairs, owners = [], []
+    for p, (i, j) in enumerate(pairs):
+        if files[i].is_dir() or files[j].is_dir():
+            for a in range(starts[i], starts[i + 1]):
+                for b in range(starts[j], starts[j + 1]):
+                    # Empty files can't match anything and their scores can't be normalized
+                    if self_similarities[a] + self_similarities[b] > 0:
+                        file_pairs.append((a, b))
+                        owners.append(p)
+    if not file_pairs:
+        return matching_files
+    file_pairs_array, owners_array = np.array(file_pairs, dtype=np.int64), np.array(owners, dtype=np.int64)
+    scores = run_candidate_comparisons(
+        tokens, offsets, similarity_matrix, self_similarities, file_pairs_array, band, jobs
+    )
+    # Scores are normalized by the sizes of the files so the file pairs are ranked by their alignment scores instead
+    alignment_scores = scores * self_similarities[file_pairs_array].sum(axis=1)
+    order = np.lexsort((-alignment_scores, owners_array))
+    for k in order[np.r_[True, owners_array[order][1:] != owners_array[order][:-1]]]:
+        (i, j), (a, b) = pairs[owners_array[k]], file_pairs[k]
+        matching_files[owners_array[k]] = {
+            files[submission]: source_files[submission][file - starts[submission]]
+            for submission, file in ((i, a), (j, b))
+            if files[submission].is_dir()
+        }
+    return matching_files
+
+
+def convert_results(
+    scores: np.ndarray, pairs: np.ndarray, files: List[Path], matching_files: List[Dict[Path, Path]]
+) -> Iterator[Tuple[frozenset, Match]]:
+    for (i, j), score, matching in zip(pairs, scores, matching_files):
+        yield frozenset((files[i], files[j])), Match(score, matching)
+
+
+def convert_corpus_results(
+    scores: np.ndarray, pairs: np.ndarray, files: List[Path], corpus_result_names: List[str]
+) -> Iterator[Tuple[frozenset, Match]]:
+    for (i, k), score in zip(pairs, scores):
+        yield frozenset((files[i], PurePosixPath(corpus_result_names[k]))), Match(score)
+
+
+def get_corpus_result_names(corpus_section: CorpusSection) -> List[str]:
+    """Adds the beginning of the content hash to the names that several corpus entries share
+    (e.g. the same homework from different semesters) so that their matches can be told apart
+    """
+    name_counts = Counter(corpus_section.names)
+    return [
+        name if name_counts[name] == 1 else f"{name}@{hash_[:8]}"
+        for name, hash_ in zip(corpus_section.names, corpus_section.hashes)
+    ]
 
 
-def convert_results(results: np.ndarray, files: List[Path]) -> dict:
-    converted_results = {}
-    for i in range(len(results)):
-        for j in range(i + 1, len(results)):
-            converted_results[frozenset((files[i], files[j]))] = results[i, j]
-    return converted_results
+def get_corpus_name(path: Path) -> str:
+    return f"{path.parent.name}/{path.name}"
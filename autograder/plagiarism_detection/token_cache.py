@@ -0,0 +1,70 @@
+import functools
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ..util import get_cache_dir, get_content_hash, get_path_hash
+
+L = logging.getLogger("AUTOGRADER.plagiarism_detection.token_cache")
+
+TOKEN_DTYPE = np.int16
+# The array module counterpart of TOKEN_DTYPE
+TOKEN_TYPECODE = "h"
+# Separates the source files of directory submissions. antlr never produces this token type
+SEPARATOR_TOKEN = 0
+
+
+class TokenCache:
+    """A content-addressed store of the token streams of lexed files that survives between plagiarism checks.
+
+    Every entry is a .npy file named after the hash of the file contents and of everything
+    that could affect lexing so that only new or changed files ever need to be lexed again.
+    """
+
+    directory: Path
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    @staticmethod
+    def make_key(content: bytes, lexer_class: type, ignore_list: np.ndarray, num_tokens: int) -> str:
+        return get_content_hash(get_lexer_hash(lexer_class), str(ignore_list.tolist()), str(num_tokens), content)
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        """Returns None on cache miss"""
+        try:
+            tokens = np.load(self._get_entry_path(key))
+        except (FileNotFoundError, ValueError):
+            return None
+        L.debug(f"TOKEN CACHE HIT: {key}")
+        return tokens
+
+    def store(self, key: str, tokens: np.ndarray) -> None:
+        entry = self._get_entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # Writing into a temporary file first makes the entry appear atomically for concurrent autograder runs
+        temporary_entry = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        with temporary_entry.open("wb") as f:
+            np.save(f, tokens.astype(TOKEN_DTYPE))
+        os.replace(temporary_entry, entry)
+
+    def _get_entry_path(self, key: str) -> Path:
+        # Splitting entries into subdirectories keeps directory listings short for large caches
+        return self.directory / key[:2] / f"{key}.npy"
+
+
+def get_token_cache() -> TokenCache:
+    return TokenCache(get_cache_dir() / "tokens")
+
+
+@functools.lru_cache(maxsize=None)
+def get_lexer_hash(lexer_class: type) -> str:
+    """Changes whenever the grammar or our handling of the tokens changes"""
+    return get_content_hash(
+        get_path_hash(Path(sys.modules[lexer_class.__module__].__file__)),  # type: ignore
+        get_path_hash(Path(__file__).with_name("plagiarism_detection.py")),
+    )
@@ -4,11 +4,12 @@ import shutil
 import sys
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Any, List, Mapping, Optional
+from typing import Any, List, Mapping, Optional, Sequence, Union
 
 from autograder.config_manager import GradingConfig
 from autograder.testcase_utils.abstract_testcase import TestCase as AbstractTestCase
 from autograder.testcase_utils.abstract_testcase import TestCaseResult
+from autograder.testcase_utils.compilation_cache import get_compilation_cache, get_compiler_identity
 from autograder.testcase_utils.shell import EMPTY_COMMAND, ShellCommand, get_shell_command
 from autograder.util import hide_path_to_directory
 
@@ -17,6 +18,8 @@ MEMLEAK_DIR: Optional[TemporaryDirectory] = None
 PRECOMPILED_MEMLEAK_FNAME = "memleak_detector.o"
 MEMLEAK_SOURCE = Path(__file__).parent / "memleak" / "memleak_detector.c"
 MEMLEAK_HEADER = Path(__file__).parent / "memleak" / "memleak_detector.h"
+# Sources can include headers that lie next to them (for example, the ones from tests/extra)
+HEADER_SUFFIXES = {".h", ".hh", ".hpp", ".hxx"}
 L = logging.getLogger("AUTOGRADER.ttypes.gcc")
 
 
@@ -59,14 +62,16 @@ class TestCase(AbstractTestCase):
     ) -> Path:
         """Compiles student submission without linking it to speed up total compilation time"""
 
-        cli_args_lst = cli_args.split()
+        cli_args_lst: List[Union[str, Path]] = list(cli_args.split())
         if memleak_is_enabled(config.file):
             L.debug("Detected memleak to be enabled")
             async with lock:
                 if not cls.MEMLEAK_TEMP_DIR:
-                    cls.MEMLEAK_TEMP_DIR = await cls.precompile_memleak_detector(cls.TESTCASE_COMPILATION_ARGS)
+                    cls.MEMLEAK_TEMP_DIR = await cls.precompile_memleak_detector(
+                        cls.TESTCASE_COMPILATION_ARGS, config.file
+                    )
                 shutil.copy(Path(cls.MEMLEAK_TEMP_DIR.name) / PRECOMPILED_MEMLEAK_FNAME, student_dir)
-            cli_args_lst.extend(["-include", str(MEMLEAK_HEADER)])
+            cli_args_lst.extend(["-include", MEMLEAK_HEADER])
 
         copied_submission = await super().precompile_submission(
             submission, student_dir, [submission.stem], cli_args, config, lock, *args, **kwargs
@@ -77,13 +82,13 @@ class TestCase(AbstractTestCase):
         else:
             extra_args = cli_args_lst
         try:
-            await cls.compiler("-c", copied_submission, "-o", precompiled_submission, *extra_args)
+            await cls.compile(precompiled_submission, [copied_submission], extra_args, config.file, compile_only=True)
         finally:
             copied_submission.unlink()
         return precompiled_submission
 
     async def precompile_testcase(self, cli_args: str) -> None:
-        await self.compiler("-c", self.path, "-o", self.path.with_suffix(".o"), *cli_args.split())
+        await self.compile(self.path.with_suffix(".o"), [self.path], cli_args.split(), self.config, compile_only=True)
         self.path.unlink()
         self.path = self.path.with_suffix(".o")
 
@@ -97,27 +102,60 @@ class TestCase(AbstractTestCase):
             files_to_compile.append(path_to_self)
         if memleak_is_enabled(self.config):
             files_to_compile.append(precompiled_submission.with_name(PRECOMPILED_MEMLEAK_FNAME))
-        await self.compiler(
-            "-o",
+        await self.compile(
             executable_path,
-            *files_to_compile,
-            *cli_args.split(),
-            *self.TESTCASE_COMPILATION_ARGS,
+            files_to_compile,
+            [*cli_args.split(), *self.TESTCASE_COMPILATION_ARGS],
+            self.config,
         )
 
         return ShellCommand(executable_path)
 
     @classmethod
-    async def precompile_memleak_detector(cls, compilation_args: List[Any]) -> TemporaryDirectory:
+    async def compile(
+        cls,
+        output: Path,
+        inputs: Sequence[Path],
+        flags: Sequence[Union[str, Path]],
+        config: Mapping[str, Any],
+        compile_only: bool = False,
+    ) -> None:
+        """Runs the compiler unless the same inputs have already been compiled with the same flags and compiler.
+        In that case, the output is taken from the compilation cache.
+
+        Path flags (such as "-include" headers) are hashed by their contents.
+        """
+        mode = ["-c"] if compile_only else []
+        cache = get_compilation_cache(config)
+        if cache is None:
+            await cls.compiler(*mode, "-o", output, *inputs, *flags)
+            return
+        key_parts: List[Union[str, bytes]] = [await get_compiler_identity(cls.compiler), *mode, output.suffix]
+        for flag in flags:
+            key_parts.append(str(flag))
+            if isinstance(flag, Path):
+                key_parts.append(flag.read_bytes())
+        for path in inputs:
+            key_parts.extend((path.name, path.read_bytes()))
+        if compile_only:
+            for directory in {p.parent for p in inputs}:
+                for header in sorted(directory.iterdir()):
+                    if header.suffix in HEADER_SUFFIXES and header.is_file():
+                        key_parts.extend((header.name, header.read_bytes()))
+        key = cache.make_key(*key_parts)
+        if not cache.load(key, output):
+            await cls.compiler(*mode, "-o", output, *inputs, *flags)
+            cache.store(key, output)
+
+    @classmethod
+    async def precompile_memleak_detector(
+        cls, compilation_args: List[Any], config: Mapping[str, Any]
+    ) -> TemporaryDirectory:
         memleak_temp_dir = TemporaryDirectory()
         tmp = Path(memleak_temp_dir.name)
         L.debug(f"CREATED TMP DIR FOR MEMLEAK, {memleak_temp_dir.name}")
-        await cls.compiler(
-            "-c",
-            MEMLEAK_SOURCE,
-            "-o",
-            tmp / PRECOMPILED_MEMLEAK_FNAME,
-            *compilation_args,
+        await cls.compile(
+            tmp / PRECOMPILED_MEMLEAK_FNAME, [MEMLEAK_SOURCE], compilation_args, config, compile_only=True
         )
         return memleak_temp_dir
 
@@ -2,16 +2,21 @@ import asyncio
 import dataclasses
 import os
 import shutil
+import statistics
 import sys
 from abc import ABC, ABCMeta, abstractmethod
 from asyncio import TimeoutError
 from inspect import getsourcefile
 from pathlib import Path
-from typing import Any, Dict, List, Mapping
+from typing import Any, Dict, List, Mapping, Optional
 
 from ..config_manager import GradingConfig
+from ..tracing import tracer
 from .exit_codes import SYSTEM_RESERVED_EXIT_CODES, USED_EXIT_CODES, ExitCodeEventType
-from .shell import ShellCommand, ShellError
+from .performance import MIN_REFERENCE_CPU_TIME, PerformanceGrading
+from .resource_limits import ResourceLimits
+from .scheduler import Scheduler
+from .shell import OutputLimitExceededError, ResourceUsage, ShellCommand, ShellCommandResult, ShellError
 from .test_helper_formatter import get_formatted_test_helper
 from .testcase_io import TestCaseIO
 from .testcase_result_validator import generate_validating_string, validate_output
@@ -22,6 +27,7 @@ class TestCaseResult:
     grade: float
     message: str
     extra_output_fields: Dict[str, str] = dataclasses.field(default_factory=dict)
+    resource_usage: Optional[ResourceUsage] = None
 
 
 class SourceDirSaver(ABCMeta, type):
@@ -90,10 +96,18 @@ class TestCase(ABC, metaclass=SourceDirSaver):
         config: Mapping[str, Any],
         testcase_picker,
         prepend_test_helper: bool = True,
+        max_output_bytes: int = 0,
+        resource_limits: ResourceLimits = ResourceLimits(),
+        performance: Optional[PerformanceGrading] = None,
     ):
         self.test_helpers_dir = self.type_source_file.parent / "helpers"
         self.path = path
         self.timeout = timeout
+        self.max_output_bytes = max_output_bytes
+        self.resource_limits = resource_limits
+        self.performance = performance
+        # Gets measured by the grader before any submission is graded
+        self.reference_cpu_time: Optional[float] = None
         self.weight = weight
         self.max_score = int(weight * 100)
 
@@ -159,20 +173,91 @@ class TestCase(ABC, metaclass=SourceDirSaver):
         precompiled_submission: Path,
         testcase_compilation_args: str,
         testcase_runtime_args: str,
+        scheduler: Optional[Scheduler] = None,
     ) -> TestCaseResult:
         """Returns student score and message to be displayed"""
+        if scheduler is None:
+            scheduler = Scheduler.unlimited()
         shutil.copy(self.path, precompiled_submission.with_name(self.path.name))
         try:
-            test_executable = await self.compile_testcase(precompiled_submission, testcase_compilation_args)
+            async with scheduler.compilation:
+                with tracer.span("compile_testcase", testcase=self.name):
+                    test_executable = await self.compile_testcase(precompiled_submission, testcase_compilation_args)
         except ShellError as e:
             return TestCaseResult(0, e.format("Failed to compile"))
 
-        result = await self._weightless_run(precompiled_submission, test_executable, testcase_runtime_args)
+        async with scheduler.execution:
+            result = await self._weightless_run(precompiled_submission, test_executable, testcase_runtime_args)
+            if self.performance is not None and result.grade > 0:
+                result = await self._grade_performance(
+                    precompiled_submission, test_executable, testcase_runtime_args, result
+                )
         result.grade *= self.weight
 
         self.delete_executable_files(precompiled_submission)
         return result
 
+    async def measure_reference_cpu_time(
+        self,
+        precompiled_reference: Path,
+        testcase_compilation_args: str,
+        testcase_runtime_args: str,
+        scheduler: Scheduler,
+    ) -> Optional[float]:
+        """Returns the median CPU time of the reference solution or None if it fails the testcase"""
+        shutil.copy(self.path, precompiled_reference.with_name(self.path.name))
+        try:
+            async with scheduler.compilation:
+                test_executable = await self.compile_testcase(precompiled_reference, testcase_compilation_args)
+        except ShellError:
+            return None
+        async with scheduler.execution:
+            cpu_time = await self._measure_cpu_time(precompiled_reference, test_executable, testcase_runtime_args)
+        self.delete_executable_files(precompiled_reference)
+        return cpu_time
+
+    async def _grade_performance(
+        self,
+        precompiled_submission: Path,
+        compiled_testcase: ShellCommand,
+        testcase_runtime_args: str,
+        result: TestCaseResult,
+    ) -> TestCaseResult:
+        """Scales the score of a successful run using the performance curve"""
+        assert self.performance is not None
+        if self.reference_cpu_time is None:
+            raise ValueError(f"CPU time of the reference solution has not been measured for '{self.name}'")
+        cpu_time = await self._measure_cpu_time(precompiled_submission, compiled_testcase, testcase_runtime_args)
+        if cpu_time is None:
+            return TestCaseResult(0, "Failed during repeated runs for performance measurement")
+        ratio = cpu_time / max(self.reference_cpu_time, MIN_REFERENCE_CPU_TIME)
+        score = result.grade * self.performance.get_score(ratio) / 100
+        performance_result = self._make_result(score)
+        if score == 0:
+            # The answer was correct so _make_result's "Wrong answer" would be misleading
+            performance_result.message = f"0/{self.max_score} (Too slow)"
+        performance_result.message += f" (CPU time: {cpu_time:.3f}s, {ratio:.2f}x reference)"
+        performance_result.extra_output_fields = result.extra_output_fields
+        performance_result.resource_usage = result.resource_usage
+        return performance_result
+
+    async def _measure_cpu_time(
+        self,
+        precompiled_submission: Path,
+        compiled_testcase: ShellCommand,
+        testcase_runtime_args: str,
+    ) -> Optional[float]:
+        """Returns the median CPU time of the measured runs or None if any of the runs fails"""
+        assert self.performance is not None
+        cpu_times: List[float] = []
+        for i in range(self.performance.warmup_runs + self.performance.runs):
+            result = await self._weightless_run(precompiled_submission, compiled_testcase, testcase_runtime_args)
+            if result.grade <= 0 or result.resource_usage is None:
+                return None
+            if i >= self.performance.warmup_runs:
+                cpu_times.append(result.resource_usage.user_time + result.resource_usage.system_time)
+        return statistics.median(cpu_times)
+
     def make_executable_path(self, submission: Path) -> Path:
         """By combining test name and student name, it makes a unique path"""
         return submission.with_name(self.path.stem + submission.stem + self.executable_suffix)
@@ -204,20 +289,43 @@ class TestCase(ABC, metaclass=SourceDirSaver):
         testcase_runtime_args: str,
     ) -> TestCaseResult:
         """Returns student score (without applying testcase weight) and message to be displayed"""
+        record_resource_usage = self.config["CONFIG"]["RECORD_RESOURCE_USAGE"] or self.performance is not None
         try:
-            result = await compiled_testcase(
-                *testcase_runtime_args.split(),
-                stdin=self.io.input,
-                timeout=self.timeout,
-                cwd=precompiled_submission.parent,
-                env={"VALIDATING_STRING": self.validating_string, **os.environ},
-                allowed_exit_codes=USED_EXIT_CODES,
-            )
-            exit_code = result.returncode
+            with tracer.span("execute", testcase=self.name):
+                result = await compiled_testcase(
+                    *testcase_runtime_args.split(),
+                    stdin=self.io.input,
+                    timeout=self.timeout,
+                    cwd=precompiled_submission.parent,
+                    env={"VALIDATING_STRING": self.validating_string, **os.environ},
+                    allowed_exit_codes=USED_EXIT_CODES,
+                    max_output_size=self.max_output_bytes or None,
+                    # The resource usage tells the crashes caused by the resource limits apart from the rest
+                    measure_resource_usage=record_resource_usage or bool(self.resource_limits),
+                    **self.resource_limits.get_subprocess_kwargs(),
+                )
         except TimeoutError:
             return TestCaseResult(0, f"Exceeded time limit of {self.timeout} seconds")
+        except OutputLimitExceededError as e:
+            extra_output_fields = (
+                {"Student Stdout": e.stdout} if self.config["CONFIG"]["GENERATE_STUDENT_OUTPUTS"] else {}
+            )
+            return TestCaseResult(0, f"Exceeded output limit of {e.limit} bytes", extra_output_fields)
         except ShellError as e:
-            return TestCaseResult(0, f"Crashed due to signal {e.returncode}:\n{e.stderr}\n")
+            violation = self.resource_limits.get_violation(e.returncode, e.stderr, e.resource_usage)
+            resource_usage = e.resource_usage if record_resource_usage else None
+            if violation is not None:
+                return TestCaseResult(0, violation, resource_usage=resource_usage)
+            return TestCaseResult(
+                0, f"Crashed due to signal {e.returncode}:\n{e.stderr}\n", resource_usage=resource_usage
+            )
+        test_result = self._evaluate_run(result)
+        test_result.resource_usage = result.resource_usage if record_resource_usage else None
+        return test_result
+
+    def _evaluate_run(self, result: ShellCommandResult) -> TestCaseResult:
+        """Returns student score (without applying testcase weight) and message based on the testcase's output"""
+        exit_code = result.returncode
         raw_output = result.stdout
         output, score, output_is_valid = validate_output(raw_output, self.validating_string)
         extra_output_fields = {"Student Stdout": output} if self.config["CONFIG"]["GENERATE_STUDENT_OUTPUTS"] else {}
@@ -238,16 +346,19 @@ class TestCase(ABC, metaclass=SourceDirSaver):
             else:
                 return TestCaseResult(0, f"0/{self.max_score} (Wrong output)", extra_output_fields)
         elif exit_code == ExitCodeEventType.RESULT:
-            weighted_score = round(score * self.weight, 2)
-            # We do this to make output prettier in case the student gets full points
-            if weighted_score == self.max_score:
-                weighted_score = round(weighted_score)
-            message = f"{weighted_score}/{self.max_score}"
-            if score == 0:
-                message += " (Wrong answer)"
-            return TestCaseResult(score, message)
+            return self._make_result(score)
         elif exit_code in SYSTEM_RESERVED_EXIT_CODES or exit_code < 0:
             # We should already handle this case in try, except block. Maybe we need more info in the error?
             raise NotImplementedError(f"System error with exit code {exit_code} has not been handled.")
         else:
             raise ValueError(f"Unknown system code {exit_code} has not been handled.")
+
+    def _make_result(self, score: float) -> TestCaseResult:
+        weighted_score = round(score * self.weight, 2)
+        # We do this to make output prettier in case the student gets full points
+        if weighted_score == self.max_score:
+            weighted_score = round(weighted_score)
+        message = f"{weighted_score}/{self.max_score}"
+        if score == 0:
+            message += " (Wrong answer)"
+        return TestCaseResult(score, message)
@@ -0,0 +1,114 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from ..config_manager import MAIN_CONFIG_SECTION
+from ..util import get_cache_dir, get_content_hash
+from .shell import ShellCommand
+
+L = logging.getLogger("AUTOGRADER.testcase_utils.compilation_cache")
+
+BYTES_IN_MEGABYTE = 1024 * 1024
+# Evicting down to a fraction of the cap keeps us from rescanning the whole cache on every store
+EVICTION_TARGET_RATIO = 0.8
+TEMPORARY_ENTRY_SUFFIX = ".tmp"
+
+
+class CompilationCache:
+    """A content-addressed store of compiled files that survives between autograder runs.
+
+    Every entry is a plain file named after the hash of everything that could affect the compilation.
+    Recency is tracked through modification times which allows us to evict the least recently used
+    entries without keeping any index on disk.
+    """
+
+    directory: Path
+    max_size: int
+
+    def __init__(self, directory: Path, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self._size: Optional[int] = None
+
+    make_key = staticmethod(get_content_hash)
+
+    def load(self, key: str, destination: Path) -> bool:
+        """Copies the cached file into destination. Returns False on cache miss"""
+        entry = self._get_entry_path(key)
+        try:
+            shutil.copy(str(entry), str(destination))
+            # Marks the entry as recently used
+            os.utime(entry)
+        except FileNotFoundError:
+            return False
+        L.debug(f"COMPILATION CACHE HIT: {destination.name} ({key})")
+        return True
+
+    def store(self, key: str, source: Path) -> None:
+        entry = self._get_entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # Writing into a temporary file first makes the entry appear atomically for concurrent autograder runs
+        temporary_entry = entry.with_name(f"{entry.name}.{os.getpid()}{TEMPORARY_ENTRY_SUFFIX}")
+        shutil.copy(str(source), str(temporary_entry))
+        os.replace(temporary_entry, entry)
+        self._size = self._get_size() + entry.stat().st_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self) -> None:
+        entries: List[Tuple[os.stat_result, Path]] = []
+        for path in self.directory.glob("*/*"):
+            if path.suffix != TEMPORARY_ENTRY_SUFFIX:
+                try:
+                    entries.append((path.stat(), path))
+                except FileNotFoundError:
+                    # Another autograder process has evicted it already
+                    pass
+        entries.sort(key=lambda e: e[0].st_mtime)
+        size = sum(stat.st_size for stat, _ in entries)
+        target_size = self.max_size * EVICTION_TARGET_RATIO
+        for stat, path in entries:
+            if size <= target_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= stat.st_size
+        self._size = size
+
+    def _get_size(self) -> int:
+        if self._size is None:
+            self._size = sum(p.stat().st_size for p in self.directory.glob("*/*"))
+        return self._size
+
+    def _get_entry_path(self, key: str) -> Path:
+        # Splitting entries into subdirectories keeps directory listings short for large caches
+        return self.directory / key[:2] / key
+
+
+_caches: Dict[Tuple[Path, int], CompilationCache] = {}
+_compiler_identities: Dict[str, str] = {}
+
+
+def get_compilation_cache(config: Mapping[str, Any]) -> Optional[CompilationCache]:
+    """Returns None if caching is disabled in config"""
+    cfg = config[MAIN_CONFIG_SECTION]
+    max_size = int(cfg["COMPILATION_CACHE_SIZE"] * BYTES_IN_MEGABYTE)
+    if not cfg["USE_CACHE"] or max_size <= 0:
+        return None
+    directory = get_cache_dir() / "compilation"
+    if (directory, max_size) not in _caches:
+        _caches[directory, max_size] = CompilationCache(directory, max_size)
+    return _caches[directory, max_size]
+
+
+async def get_compiler_identity(compiler: ShellCommand) -> str:
+    """Returns a string that changes whenever the compiler gets replaced or updated"""
+    name = str(compiler.command_name)
+    if name not in _compiler_identities:
+        result = await compiler("--version")
+        _compiler_identities[name] = f"{shutil.which(name)}\n{result.stdout}"
+    return _compiler_identities[name]
@@ -0,0 +1,42 @@
+import bisect
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from ..config_manager import GradingConfig
+
+# Protects us from dividing by zero when the reference solution is too fast to be measured
+MIN_REFERENCE_CPU_TIME = 0.001
+
+
+@dataclass(frozen=True)
+class PerformanceGrading:
+    """Describes how a testcase is graded by CPU time relative to the reference solution
+
+    curve consists of (student_time / reference_time, score) points sorted by the ratio.
+    Scores between the points are linearly interpolated and the scores outside of them are clamped.
+    """
+
+    runs: int
+    warmup_runs: int
+    curve: Tuple[Tuple[float, float], ...]
+
+    def get_score(self, ratio: float) -> float:
+        ratios = [r for r, _ in self.curve]
+        i = bisect.bisect_left(ratios, ratio)
+        if i == 0:
+            return self.curve[0][1]
+        elif i == len(self.curve):
+            return self.curve[-1][1]
+        (left_ratio, left_score), (right_ratio, right_score) = self.curve[i - 1], self.curve[i]
+        return left_score + (right_score - left_score) * (ratio - left_ratio) / (right_ratio - left_ratio)
+
+
+def get_performance_grading(config: GradingConfig, test_name: str) -> Optional[PerformanceGrading]:
+    """Returns None if the testcase is not graded by performance"""
+    runs = config.performance_runs[test_name]
+    if not runs:
+        return None
+    curve = tuple(sorted((float(ratio), float(score)) for ratio, score in config.performance_curves[test_name]))
+    if not curve:
+        raise ValueError(f"Performance curve of '{test_name}' must contain at least one point")
+    return PerformanceGrading(runs, config.performance_warmup_runs[test_name], curve)
@@ -0,0 +1,102 @@
+import math
+import signal
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from ..config_manager import GradingConfig
+from .shell import ResourceUsage
+
+if sys.platform != "win32":
+    import resource
+
+BYTES_IN_MEGABYTE = 1024 * 1024
+# The process gets SIGXCPU once it reaches the soft cpu limit and SIGKILL once it reaches the hard one
+CPU_TIME_HARD_LIMIT_MARGIN = 1
+# What the runtimes of the supported languages print when they fail to allocate memory
+MEMORY_ERROR_MARKERS = ("MemoryError", "std::bad_alloc", "OutOfMemoryError", "Cannot allocate memory")
+PROCESS_LIMIT_MARKERS = ("Resource temporarily unavailable", "unable to create native thread")
+# Some runtimes (e.g. python) ignore SIGXFSZ so their writes fail with EFBIG instead
+FILE_SIZE_LIMIT_MARKERS = ("File too large",)
+# Programs that don't check the results of their allocations crash instead of reporting the failure.
+# The memory limit covers the whole address space (including the code of the program and of its libraries)
+# so the peak resident memory of such a program never quite reaches the limit, only comes close to it
+MEMORY_LIMIT_USAGE_RATIO = 0.8
+CRASH_SIGNALS = (signal.SIGSEGV, signal.SIGBUS, signal.SIGABRT, signal.SIGKILL)
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    """Limits applied to the testcase process (and inherited by its children) using setrlimit.
+    0 means that the resource is not limited.
+
+    Note that memory limits the virtual address space, not the resident memory, and that
+    the process limit counts all processes of the user running the autograder.
+    """
+
+    memory: int = 0
+    cpu_time: float = 0
+    processes: int = 0
+    file_size: int = 0
+
+    def __bool__(self) -> bool:
+        return any((self.memory, self.cpu_time, self.processes, self.file_size))
+
+    def get_subprocess_kwargs(self) -> Dict[str, Any]:
+        """setrlimit is only available on unix so the limits are silently ignored on Windows"""
+        if not self or sys.platform == "win32":
+            return {}
+        return {"preexec_fn": self.apply}
+
+    def apply(self) -> None:
+        """Runs in the child process right before the testcase gets executed"""
+        if self.memory:
+            resource.setrlimit(resource.RLIMIT_AS, (self.memory, self.memory))
+        if self.cpu_time:
+            seconds = math.ceil(self.cpu_time)
+            resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + CPU_TIME_HARD_LIMIT_MARGIN))
+        if self.processes:
+            resource.setrlimit(resource.RLIMIT_NPROC, (self.processes, self.processes))
+        if self.file_size:
+            resource.setrlimit(resource.RLIMIT_FSIZE, (self.file_size, self.file_size))
+
+    def get_violation(
+        self, returncode: int, stderr: str, resource_usage: Optional[ResourceUsage] = None
+    ) -> Optional[str]:
+        """Returns the message describing the exceeded limit or None if the process failed for other reasons.
+
+        SIGKILL is only attributed to the CPU time limit and crashes are only attributed to the memory limit
+        if the resource usage of the process (see ShellCommand's measure_resource_usage) shows that it reached them
+        """
+        if sys.platform == "win32":
+            return None
+        if self.cpu_time and (
+            returncode == -signal.SIGXCPU
+            or returncode == -signal.SIGKILL
+            and resource_usage is not None
+            and resource_usage.user_time + resource_usage.system_time >= self.cpu_time
+        ):
+            return f"Exceeded CPU time limit of {self.cpu_time} seconds"
+        if self.file_size and (
+            returncode == -signal.SIGXFSZ or any(marker in stderr for marker in FILE_SIZE_LIMIT_MARKERS)
+        ):
+            return f"Exceeded file size limit of {self.file_size / BYTES_IN_MEGABYTE:g} MB"
+        if self.memory and (
+            any(marker in stderr for marker in MEMORY_ERROR_MARKERS)
+            or -returncode in CRASH_SIGNALS
+            and resource_usage is not None
+            and resource_usage.max_memory >= self.memory * MEMORY_LIMIT_USAGE_RATIO
+        ):
+            return f"Exceeded memory limit of {self.memory / BYTES_IN_MEGABYTE:g} MB"
+        if self.processes and any(marker in stderr for marker in PROCESS_LIMIT_MARKERS):
+            return f"Exceeded process limit of {self.processes}"
+        return None
+
+
+def get_resource_limits(config: GradingConfig, test_name: str) -> ResourceLimits:
+    return ResourceLimits(
+        memory=int(config.memory_limits[test_name] * BYTES_IN_MEGABYTE),
+        cpu_time=config.cpu_time_limits[test_name],
+        processes=config.process_limits[test_name],
+        file_size=int(config.file_size_limits[test_name] * BYTES_IN_MEGABYTE),
+    )
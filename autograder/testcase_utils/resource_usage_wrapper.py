@@ -0,0 +1,45 @@
+"""Runs a command and writes "USER_TIME SYSTEM_TIME MAX_MEMORY" of it into a file descriptor.
+
+asyncio reaps its child processes by itself so we cannot call wait4 on them directly.
+Instead, this script becomes the direct parent of the command, waits for it, and then
+exits the same way the command did so that the caller can treat it as the command itself.
+
+Note that Linux carries the peak memory of a process over exec so the measured peak memory
+never goes below the memory of this script (a few megabytes). That's why we avoid imports here.
+
+Usage: python -I -S resource_usage_wrapper.py FD COMMAND [ARGS...]
+"""
+
+import os
+import signal
+import sys
+
+# ru_maxrss is measured in bytes on macOS and in kilobytes everywhere else
+MAX_RSS_MULTIPLIER = 1 if sys.platform == "darwin" else 1024
+
+
+def main() -> None:
+    fd = int(sys.argv[1])
+    command = sys.argv[2:]
+    # The command must not be able to write into our file descriptor or keep it open after we exit
+    os.set_inheritable(fd, False)
+    try:
+        pid = os.posix_spawnp(command[0], command, os.environ)
+    except OSError as e:
+        print(f"{command[0]}: {e.strerror}", file=sys.stderr)
+        sys.exit(127)
+    _, status, usage = os.wait4(pid, 0)
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{usage.ru_utime} {usage.ru_stime} {usage.ru_maxrss * MAX_RSS_MULTIPLIER}")
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        # SIGKILL can't be handled (or have its handler reset) so it always terminates us anyway
+        if sig != signal.SIGKILL:
+            signal.signal(sig, signal.SIG_DFL)
+        os.kill(os.getpid(), sig)
+    # Same as os.waitstatus_to_exitcode which is only available since python 3.9
+    sys.exit(os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status))
+
+
+if __name__ == "__main__":
+    main()
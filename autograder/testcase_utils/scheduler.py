@@ -0,0 +1,22 @@
+import asyncio
+import sys
+
+
+class Scheduler:
+    """Limits compilation and testcase execution separately.
+
+    Submissions flow from compilation to execution so that these two phases
+    can overlap without either of them oversubscribing the cpu.
+    Note that it must be created within the event loop that is going to use it.
+    """
+
+    compilation: asyncio.Semaphore
+    execution: asyncio.Semaphore
+
+    def __init__(self, max_concurrent_compilations: int, max_concurrent_runs: int) -> None:
+        self.compilation = asyncio.Semaphore(max_concurrent_compilations)
+        self.execution = asyncio.Semaphore(max_concurrent_runs)
+
+    @classmethod
+    def unlimited(cls) -> "Scheduler":
+        return cls(sys.maxsize, sys.maxsize)
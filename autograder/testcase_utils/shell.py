@@ -10,16 +10,37 @@ from concurrent.futures import TimeoutError
 from dataclasses import dataclass
 from locale import getpreferredencoding
 from pathlib import Path
-from typing import Any, Collection, Dict, Optional, Union
+from typing import Any, Collection, Dict, List, Optional, Tuple, Union
 
 L = logging.getLogger("AUTOGRADER.testcase_utils.shell")
 
+READ_CHUNK_SIZE = 64 * 1024
+TRUNCATED_OUTPUT_MARKER = b"\n...\n"
+# Number of bytes from the beginning and from the end of the output that are reported when it exceeds the limit
+OUTPUT_EXCERPT_SIZE = 2048
+RESOURCE_USAGE_WRAPPER = Path(__file__).parent / "resource_usage_wrapper.py"
+BYTES_IN_MEGABYTE = 1024 * 1024
+
+
+@dataclass
+class ResourceUsage:
+    user_time: float
+    system_time: float
+    max_memory: int  # Peak resident set size in bytes
+
+    def format(self) -> str:
+        return (
+            f"{self.user_time:.3f}s user, {self.system_time:.3f}s system, "
+            f"{self.max_memory / BYTES_IN_MEGABYTE:.1f} MB peak memory"
+        )
+
 
 @dataclass
 class ShellCommandResult:
     returncode: int
     stdout: str
     stderr: str
+    resource_usage: Optional[ResourceUsage] = None
 
 
 @dataclass
@@ -34,9 +55,25 @@ class ShellCommand:
         allowed_exit_codes: Collection[int] = (0,),
         timeout: Optional[float] = None,
         stdin: str = "",
+        max_output_size: Optional[int] = None,
+        measure_resource_usage: bool = False,
         **kwargs: Any,
     ) -> ShellCommandResult:
+        """If max_output_size is set, the output is streamed instead of being read at once
+        and the process is killed as soon as stdout and stderr combined exceed max_output_size bytes.
+
+        If measure_resource_usage is set, the cpu time and the peak memory of the command are
+        returned along with its output. It is not supported on Windows.
+        """
+        command: List[object] = [self.command_name, *args]
         os_specific_kwargs: Dict[str, Any] = {}
+        usage_reader = usage_writer = None
+        if measure_resource_usage and sys.platform != "win32":
+            usage_reader, usage_writer = os.pipe()
+            command = [sys.executable, "-I", "-S", RESOURCE_USAGE_WRAPPER, usage_writer, *command]
+            os_specific_kwargs["pass_fds"] = (usage_writer,)
+            # Allows us to kill both the wrapper and the command at once
+            os_specific_kwargs["start_new_session"] = True
         if sys.platform == "win32":
             os_specific_kwargs["startupinfo"] = synchronous_subprocess.STARTUPINFO(
                 dwFlags=synchronous_subprocess.STARTF_USESHOWWINDOW,
@@ -44,63 +81,208 @@ class ShellCommand:
             )
             if "env" in kwargs:
                 kwargs["env"].update({"SYSTEMROOT": os.environ["SYSTEMROOT"]})
-        process = await subprocess.create_subprocess_exec(
-            # Linux handles non-string args well yet Windows doesn't
-            str(self.command_name),
-            *[str(a) for a in args],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            **kwargs,
-            **os_specific_kwargs,
-        )
-        # That's the same way subprocess.Popen(text=True) gets the encoding
-        encoding = getpreferredencoding(False)
         try:
-            result = await asyncio.wait_for(process.communicate(input=stdin.encode(encoding)), timeout=timeout)
-        except TimeoutError as e:
-            # Windows doesn't know how to clean up its processes
-            if process.returncode is None and sys.platform == "win32":
-                # We could probably do this asynchronously but I am too lazy to test it
-                synchronous_subprocess.run(
-                    ["taskkill", "/F", "/T", "/PID", str(process.pid)],
-                    **os_specific_kwargs,
-                    stdout=synchronous_subprocess.DEVNULL,
-                    stderr=synchronous_subprocess.DEVNULL,
-                )
-            else:
-                # For infinite processes
-                os.kill(process.pid, signal.SIGKILL)
-            raise e
+            process = await subprocess.create_subprocess_exec(
+                # Linux handles non-string args well yet Windows doesn't
+                *[str(a) for a in command],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.PIPE,
+                **kwargs,
+                **os_specific_kwargs,
+            )
+        finally:
+            if usage_writer is not None:
+                os.close(usage_writer)
+        try:
+            result = await self._communicate(process, stdin, timeout, max_output_size, os_specific_kwargs)
+            resource_usage = None if usage_reader is None else _read_resource_usage(usage_reader)
+        finally:
+            if usage_reader is not None:
+                os.close(usage_reader)
 
-        stdout, stderr = (s.decode(encoding) for s in result)
-        L.debug(
-            f"""({process.returncode}) EXECUTED CMD: {self.command_name} {' '.join([str(a) for a in args])}
+        stdout, stderr = result
+        L.debug(f"""({process.returncode}) EXECUTED CMD: {self.command_name} {' '.join([str(a) for a in args])}
     STDOUT: {stdout.strip()}
     STDERR: {stderr.strip()}
-        """
-        )
+        """)
         returncode = process.returncode if process.returncode is not None else -1
         # Possible fix for OSX sometimes not recognizing correct returncodes
         # Delete after testing if unnecessary
         if process.returncode not in allowed_exit_codes:
-            raise ShellError(returncode, stderr)
-        return ShellCommandResult(returncode, stdout, stderr)
+            raise ShellError(returncode, stderr, resource_usage)
+        return ShellCommandResult(returncode, stdout, stderr, resource_usage)
+
+    @staticmethod
+    async def _communicate(
+        process: subprocess.Process,
+        stdin: str,
+        timeout: Optional[float],
+        max_output_size: Optional[int],
+        os_specific_kwargs: Dict[str, Any],
+    ) -> Tuple[str, str]:
+        # That's the same way subprocess.Popen(text=True) gets the encoding
+        encoding = getpreferredencoding(False)
+        if max_output_size is None:
+            communication = process.communicate(input=stdin.encode(encoding))
+        else:
+            communication = _communicate_with_output_limit(process, stdin.encode(encoding), max_output_size)
+        try:
+            result = await asyncio.wait_for(communication, timeout=timeout)
+        except TimeoutError as e:
+            _kill(process, os_specific_kwargs)
+            raise e
+        except OutputLimitExceededError as e:
+            _kill(process, os_specific_kwargs)
+            await process.wait()
+            e.stdout, e.stderr = (s.decode(encoding, errors="replace") for s in (e.raw_stdout, e.raw_stderr))
+            raise e
+        stdout, stderr = (s.decode(encoding) for s in result)
+        return stdout, stderr
 
 
 EMPTY_COMMAND = ShellCommand("false")
 
 
 class ShellError(Exception):
-    def __init__(self, returncode: int, stderr: str):
+    def __init__(self, returncode: int, stderr: str, resource_usage: Optional[ResourceUsage] = None):
         super().__init__(stderr)
         self.returncode = returncode
         self.stderr = stderr
+        self.resource_usage = resource_usage
 
     def format(self, title: str) -> str:
         return f"{title}\n{self.stderr}"
 
 
+class OutputLimitExceededError(ShellError):
+    """stdout and stderr only contain excerpts from the beginning and the end of the output"""
+
+    stdout: str
+
+    def __init__(self, limit: int, raw_stdout: bytes, raw_stderr: bytes):
+        super().__init__(-1, "")
+        self.limit = limit
+        self.raw_stdout = raw_stdout
+        self.raw_stderr = raw_stderr
+        self.stdout = ""
+
+
+class _BoundedOutput:
+    """Keeps the head and the tail of a stream while discarding everything in the middle"""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_head_size = max_size // 2
+        self.max_tail_size = max_size - self.max_head_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+
+    def append(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        free_head_space = self.max_head_size - len(self.head)
+        if free_head_space > 0:
+            self.head += chunk[:free_head_space]
+            chunk = chunk[free_head_space:]
+        self.tail += chunk
+        if len(self.tail) > self.max_tail_size:
+            del self.tail[: len(self.tail) - self.max_tail_size]
+
+    def getvalue(self) -> bytes:
+        if self.size > len(self.head) + len(self.tail):
+            return bytes(self.head + TRUNCATED_OUTPUT_MARKER + self.tail)
+        return bytes(self.head + self.tail)
+
+    def get_excerpt(self, size: int) -> bytes:
+        if self.size > 2 * size:
+            return bytes(self.head[:size] + TRUNCATED_OUTPUT_MARKER + self.tail[-size:])
+        return self.getvalue()
+
+
+async def _communicate_with_output_limit(
+    process: subprocess.Process, input: bytes, max_output_size: int
+) -> Tuple[bytes, bytes]:
+    """An equivalent of process.communicate() that never keeps more than max_output_size bytes of output.
+    Raises OutputLimitExceededError as soon as the limit is exceeded
+    """
+    outputs = [_BoundedOutput(max_output_size), _BoundedOutput(max_output_size)]
+
+    async def feed_stdin() -> None:
+        assert process.stdin is not None
+        try:
+            if input:
+                process.stdin.write(input)
+                await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            # The process has exited or has been killed before reading all of its input
+            pass
+
+    async def read(stream: Optional[asyncio.StreamReader], output: _BoundedOutput) -> None:
+        assert stream is not None
+        while True:
+            chunk = await stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            output.append(chunk)
+            if sum(o.size for o in outputs) > max_output_size:
+                raise OutputLimitExceededError(
+                    max_output_size,
+                    outputs[0].get_excerpt(OUTPUT_EXCERPT_SIZE),
+                    outputs[1].get_excerpt(OUTPUT_EXCERPT_SIZE),
+                )
+
+    tasks: List[asyncio.Future] = [
+        asyncio.ensure_future(feed_stdin()),
+        asyncio.ensure_future(read(process.stdout, outputs[0])),
+        asyncio.ensure_future(read(process.stderr, outputs[1])),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    await process.wait()
+    return outputs[0].getvalue(), outputs[1].getvalue()
+
+
+def _kill(process: subprocess.Process, os_specific_kwargs: Dict[str, Any]) -> None:
+    # Windows doesn't know how to clean up its processes
+    if process.returncode is None and sys.platform == "win32":
+        # We could probably do this asynchronously but I am too lazy to test it
+        synchronous_subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+            **os_specific_kwargs,
+            stdout=synchronous_subprocess.DEVNULL,
+            stderr=synchronous_subprocess.DEVNULL,
+        )
+    elif process.returncode is None:
+        # For infinite processes
+        try:
+            if os_specific_kwargs.get("start_new_session"):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                os.kill(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # It has exited on its own in the meantime
+            pass
+
+
+def _read_resource_usage(fd: int) -> Optional[ResourceUsage]:
+    """Returns None if the wrapper has been killed before reporting the usage"""
+    chunks: List[bytes] = []
+    while True:
+        chunk = os.read(fd, READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    try:
+        user_time, system_time, max_memory = b"".join(chunks).split()
+        return ResourceUsage(float(user_time), float(system_time), int(max_memory))
+    except ValueError:
+        return None
+
+
 def get_shell_command(command: str) -> ShellCommand:
     """An API for commands that postpone throwing non-existence errors from creation to runtime"""
     return EMPTY_COMMAND if shutil.which(command) is None else ShellCommand(command)
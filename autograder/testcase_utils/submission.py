@@ -7,6 +7,7 @@ from tempfile import TemporaryDirectory
 from typing import Dict, List, Optional, Type
 
 from .abstract_testcase import TestCase
+from .shell import ResourceUsage
 
 L = getLogger()
 
@@ -32,6 +33,17 @@ class TestCaseGrade:
     testcase_weight: float
     message: str
     extra_output_fields: Dict[str, str]
+    resource_usage: Optional[ResourceUsage] = None
+
+
+@dataclass
+class SubmissionResults:
+    """Everything we need to transfer a graded submission between processes"""
+
+    name: str
+    grades: Dict[str, TestCaseGrade]
+    precompilation_error: str
+    final_grade: int
 
 
 class Submission:
@@ -76,8 +88,19 @@ class Submission:
         testcase_weight: float,
         message: str,
         extra_output_fields: Dict[str, str],
+        resource_usage: Optional[ResourceUsage] = None,
     ):
-        self.grades[test_name] = TestCaseGrade(testcase_score, testcase_weight, message, extra_output_fields)
+        self.grades[test_name] = TestCaseGrade(
+            testcase_score, testcase_weight, message, extra_output_fields, resource_usage
+        )
+
+    def get_results(self) -> SubmissionResults:
+        return SubmissionResults(self.old_path.name, self.grades, self.precompilation_error, self.final_grade)
+
+    def set_results(self, results: SubmissionResults) -> None:
+        self.grades = results.grades
+        self.precompilation_error = results.precompilation_error
+        self.final_grade = results.final_grade
 
     def register_precompilation_error(self, error: str) -> None:
         self.precompilation_error = error
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Callable, Dict
+from typing import Callable, Dict, Optional, Tuple
 
 from ..config_manager import DEFAULT_ARGLIST_VALUE_KEY
 
@@ -18,12 +18,24 @@ class TestCaseIO:
         formatters: Dict[str, FORMATTER_TYPE],
         input_dir: Path,
         output_dir: Path,
+        contents: Optional[Tuple[str, str]] = None,
     ):
+        """If contents (input, expected output) are supplied, the files are not read or modified.
+        This allows several processes to share a single set of testcase files.
+        """
         self.name = testcase_path.name
         self.stem = testcase_path.stem
         f = formatters  # to make next line shorter
         self.formatter = f.get(self.stem) or f.get(DEFAULT_ARGLIST_VALUE_KEY) or default_formatter
         self.output_file: Path = output_dir / f"{self.stem}.txt"
+        self.owns_output_file = contents is None
+
+        if contents is not None:
+            self.input, self.expected_output_backup = contents
+            self.expected_output = (
+                self.format_output(self.expected_output_backup) if self.expected_output_backup else ""
+            )
+            return
 
         if self.output_file.exists() and self.output_file.is_file():
             self.expected_output_backup = self.output_file.read_text()
@@ -53,8 +65,11 @@ class TestCaseIO:
         io.input = ""
         return io
 
+    def get_contents(self) -> Tuple[str, str]:
+        return self.input, self.expected_output_backup
+
     def cleanup(self):
-        if self.output_file.exists() and self.output_file.is_file():
+        if self.owns_output_file and self.output_file.exists() and self.output_file.is_file():
             self.output_file.write_text(self.expected_output_backup)
 
 
@@ -0,0 +1,149 @@
+import json
+import os
+import statistics
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Every span name in the order of the grading pipeline
+PHASES = (
+    "gather_submissions",
+    "gather_testcases",
+    "precompile_testcase",
+    "precompile_submission",
+    "compile_testcase",
+    "execute",
+    "log",
+)
+# Upper bounds (in seconds) of the buckets of the duration histogram
+HISTOGRAM_BUCKETS = (0.001, 0.01, 0.1, 1, 10)
+MICROSECONDS_IN_SECOND = 1_000_000
+
+# Tags that get attached to every span started within the current asyncio task and its children
+_context_tags: ContextVar[Dict[str, str]] = ContextVar("tracing_tags", default={})
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration: float
+    pid: int
+    tags: Dict[str, str]
+
+
+class Tracer:
+    """Records how much time is spent in each phase of grading.
+
+    It is disabled by default in which case spans cost next to nothing.
+    Spans are tagged with the names of the submission and the testcase they belong to
+    which allows us to export them as a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    enabled: bool
+    spans: List[Span]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.spans = []
+
+    @contextmanager
+    def span(self, name: str, **tags: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.spans.append(Span(name, start, end - start, os.getpid(), {**_context_tags.get(), **tags}))
+
+    @contextmanager
+    def tags(self, **tags: str) -> Iterator[None]:
+        """Tags all spans started within this block, including the ones in asyncio tasks created here"""
+        token = _context_tags.set({**_context_tags.get(), **tags})
+        try:
+            yield
+        finally:
+            _context_tags.reset(token)
+
+    def merge(self, spans: Iterable[Span]) -> None:
+        """Adds the spans recorded by another tracer (e.g. in a worker process)"""
+        self.spans.extend(spans)
+
+    def reset(self) -> None:
+        self.spans = []
+
+    def get_durations(self) -> Dict[str, List[float]]:
+        durations: Dict[str, List[float]] = defaultdict(list)
+        for span in self.spans:
+            durations[span.name].append(span.duration)
+        return durations
+
+    def save_chrome_trace(self, path: Path) -> None:
+        """Every submission/testcase pair gets its own row so that its phases are displayed sequentially"""
+        rows: Dict[Tuple[int, str], int] = {}
+        events: List[Dict[str, Any]] = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            row_name = " / ".join(span.tags[t] for t in ("submission", "testcase") if t in span.tags) or "grader"
+            if (span.pid, row_name) not in rows:
+                rows[span.pid, row_name] = len(rows)
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": span.pid,
+                        "tid": rows[span.pid, row_name],
+                        "args": {"name": row_name},
+                    }
+                )
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "grading",
+                    "ph": "X",
+                    "ts": span.start * MICROSECONDS_IN_SECOND,
+                    "dur": span.duration * MICROSECONDS_IN_SECOND,
+                    "pid": span.pid,
+                    "tid": rows[span.pid, row_name],
+                    "args": span.tags,
+                }
+            )
+        path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+    def format_summary(self, phases: Optional[Iterable[str]] = None) -> str:
+        """Returns a histogram of span durations for every phase"""
+        durations = self.get_durations()
+        bucket_names = [f"<{_format_duration(b)}" for b in HISTOGRAM_BUCKETS] + [
+            f">={_format_duration(HISTOGRAM_BUCKETS[-1])}"
+        ]
+        header = f"{'Phase':<24}{'Count':>7}{'Total':>10}{'Median':>10}{'Max':>10}" + "".join(
+            f"{b:>8}" for b in bucket_names
+        )
+        lines = [header]
+        for phase in phases or [*PHASES, *sorted(set(durations) - set(PHASES))]:
+            phase_durations = durations.get(phase, [])
+            if not phase_durations:
+                continue
+            buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+            for duration in phase_durations:
+                buckets[next((i for i, b in enumerate(HISTOGRAM_BUCKETS) if duration < b), len(HISTOGRAM_BUCKETS))] += 1
+            lines.append(
+                f"{phase:<24}{len(phase_durations):>7}"
+                f"{_format_duration(sum(phase_durations)):>10}"
+                f"{_format_duration(statistics.median(phase_durations)):>10}"
+                f"{_format_duration(max(phase_durations)):>10}" + "".join(f"{b:>8}" for b in buckets)
+            )
+        return "\n".join(lines)
+
+
+def _format_duration(seconds: float) -> str:
+    return f"{seconds * 1000:.3g}ms" if seconds < 1 else f"{seconds:.3g}s"
+
+
+tracer = Tracer()
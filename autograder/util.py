@@ -1,8 +1,10 @@
+import hashlib
 import importlib.util
+import os
 import sys
 from pathlib import Path
 from types import ModuleType
-from typing import Dict, Iterable, Type
+from typing import Dict, Iterable, Type, Union
 
 
 class AutograderError(Exception):
@@ -20,6 +22,36 @@ def import_from_path(module_name: str, path: Path) -> ModuleType:
     return module
 
 
+def get_cache_dir() -> Path:
+    """Returns the directory where autograder keeps data between runs (respects XDG_CACHE_HOME)"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "autograder"
+
+
+def get_content_hash(*parts: Union[str, bytes]) -> str:
+    hasher = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        # Length prefix prevents ("ab", "c") and ("a", "bc") from producing the same hash
+        hasher.update(len(part).to_bytes(8, "little"))
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+def get_path_hash(path: Path) -> str:
+    """Hashes the contents of a file or of all files within a directory (including their relative paths)"""
+    if not path.exists():
+        return get_content_hash()
+    elif path.is_file():
+        return get_content_hash(path.read_bytes())
+    parts = []
+    for p in sorted(path.rglob("*")):
+        if p.is_file():
+            parts.extend((p.relative_to(path).as_posix(), p.read_bytes()))
+    return get_content_hash(*parts)
+
+
 def get_file_names(dir_: Path) -> Iterable[str]:
     return (p.name for p in dir_.iterdir()) if dir_.exists() else ()
 
@@ -17,3 +17,5 @@ Key:
 	Crashed due to signal SIGNAL_CODE: Your submission threw an uncaught exception.
 	All signal error codes are described here: https://man7.org/linux/man-pages/man7/signal.7.html
 	Exceeded Time Limit: Your submission took too much time to run (probably an infinite loop)
+	Exceeded Output Limit: Your submission printed too much output (probably an infinite loop)
+	Exceeded Memory/CPU Time/Process/File Size Limit: Your submission used more resources than it is allowed to
@@ -0,0 +1,5 @@
+def triangular_number(n):
+    total = 0
+    for i in range(n + 1):
+        total += i
+    return total
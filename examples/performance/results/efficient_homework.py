@@ -0,0 +1,16 @@
+Homework Test Results
+
+TestCase                                Result
+================================================================
+test_triangular_number.py               100/100 (CPU time: 0.019s, 1.15x reference)
+================================================================
+Result: 100/100
+
+Key:
+	Failed to Compile: Your submission did not compile due to a syntax or naming error
+	Compiled with warnings: Your submission uses unchecked or unsafe operations
+	Crashed due to signal SIGNAL_CODE: Your submission threw an uncaught exception.
+	All signal error codes are described here: https://man7.org/linux/man-pages/man7/signal.7.html
+	Exceeded Time Limit: Your submission took too much time to run (probably an infinite loop)
+	Exceeded Output Limit: Your submission printed too much output (probably an infinite loop)
+	Exceeded Memory/CPU Time/Process/File Size Limit: Your submission used more resources than it is allowed to
@@ -0,0 +1,14 @@
+# student_submission is provided by autograder, represents student's module, and can be used freely
+# PASS(), RESULT(res), FAIL(), and CHECK_STDOUT() are also provided by autograder
+
+N = 3_000_000
+
+
+def main():
+    if student_submission.triangular_number(N) == N * (N + 1) // 2:
+        PASS()
+    else:
+        FAIL()
+
+
+main()
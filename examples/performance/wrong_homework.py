@@ -0,0 +1,2 @@
+def triangular_number(n):
+    return n * n // 2
@@ -0,0 +1,11 @@
+from autograder.benchmark import run_benchmark
+from autograder.guide import _get_supported_languages
+
+
+def test_benchmark_measures_every_phase():
+    result = run_benchmark(_get_supported_languages()["python"], "python", submission_count=3, testcase_count=2)
+
+    assert len(result.wall_times) == 1
+    assert len(result.phase_durations["precompile_submission"]) == 3
+    assert len(result.phase_durations["execute"]) == 6
+    assert "3 submissions x 2 testcases" in result.format()
@@ -0,0 +1,37 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from autograder.testcase_utils.compilation_cache import CompilationCache
+
+
+def test_cache_roundtrip():
+    with TemporaryDirectory() as tmpdir:
+        tmp = Path(tmpdir)
+        cache = CompilationCache(tmp / "cache", 1000)
+        key = cache.make_key("gcc", b"int main() {}")
+        (tmp / "a.o").write_bytes(b"compiled")
+
+        assert not cache.load(key, tmp / "b.o")
+        cache.store(key, tmp / "a.o")
+        assert cache.load(key, tmp / "b.o")
+        assert (tmp / "b.o").read_bytes() == b"compiled"
+
+
+def test_least_recently_used_entries_get_evicted():
+    with TemporaryDirectory() as tmpdir:
+        tmp = Path(tmpdir)
+        cache = CompilationCache(tmp / "cache", 250)
+        source = tmp / "file.o"
+        source.write_bytes(b"x" * 100)
+        first, second, third = (cache.make_key(str(i)) for i in range(3))
+        cache.store(first, source)
+        cache.store(second, source)
+        # Make sure the second entry is older than the first one
+        os.utime(cache._get_entry_path(second), (0, 0))
+
+        cache.store(third, source)
+
+        assert cache.load(first, tmp / "out.o")
+        assert not cache.load(second, tmp / "out.o")
+        assert cache.load(third, tmp / "out.o")
@@ -1,9 +1,16 @@
+import inspect
 import json
+import os
+import shutil
 import sys
+from collections import Counter
 from pathlib import Path
-from typing import Union
+from tempfile import TemporaryDirectory
+from typing import List, Tuple, Union
 
+import autograder.autograder as grader_module
 from autograder.__main__ import main as autograder
+from autograder.testcase_utils.abstract_testcase import TestCase
 
 from . import tools
 
@@ -57,3 +64,152 @@ def test_fibonacci_c():
 
 def test_cheating_attempts():
     run_test("cheating_attempts", 0)
+
+
+def test_regrading_reuses_previous_grades(monkeypatch):
+    executed_testcases: List[str] = []
+    original_run = TestCase.run
+
+    async def run(self, *args, **kwargs):
+        executed_testcases.append(self.name)
+        return await original_run(self, *args, **kwargs)
+
+    def grade(test_dir: Path, *args: str) -> Tuple[dict, Counter]:
+        executed_testcases.clear()
+        with tools.silence_output() as buf:
+            autograder(["run", str(test_dir), "-j", *args])
+            submissions = json.loads(buf.getvalue())["submissions"]
+        # Extra output fields can't be compared because they include memory addresses
+        grades = {
+            (s["submission"], t["name"]): (s["final_grade"], t["message"])
+            for s in submissions
+            for t in s["testcase_scores"]
+        }
+        return grades, Counter(executed_testcases)
+
+    monkeypatch.setattr(TestCase, "run", run)
+    with TemporaryDirectory() as tmpdir:
+        test_dir = Path(tmpdir) / "fibonacci_c"
+        shutil.copytree("examples/fibonacci_c", test_dir)
+        graded_from_scratch, executed_from_scratch = grade(test_dir, "--no-cache")
+        regraded, executed_on_regrading = grade(test_dir)
+        testcase = test_dir / "tests" / "testcases" / "test_output.c"
+        testcase.write_text(testcase.read_text() + "\n")
+        graded_after_change, executed_after_change = grade(test_dir)
+
+    assert regraded == graded_after_change == graded_from_scratch
+    assert executed_from_scratch["test_output.c"] > 0
+    assert not executed_on_regrading
+    assert executed_after_change == {"test_output.c": executed_from_scratch["test_output.c"]}
+
+
+def test_regrading_picks_up_new_testcases():
+    with TemporaryDirectory() as tmpdir:
+        test_dir = Path(tmpdir) / "multiple_languages"
+        shutil.copytree("examples/multiple_languages", test_dir)
+        testcase = test_dir / "tests" / "testcases" / "check_result.py"
+        testcase_source = testcase.read_text()
+        testcase.unlink()
+        with tools.silence_output() as buf:
+            autograder(["run", str(test_dir), "-j", "--no-cache"])
+            graded_without_testcase = json.loads(buf.getvalue())["submissions"]
+        testcase.write_text(testcase_source)
+        with tools.silence_output() as buf:
+            autograder(["run", str(test_dir), "-j"])
+            graded_with_testcase = json.loads(buf.getvalue())["submissions"]
+    assert {s["submission"]: s["final_grade"] for s in graded_without_testcase} == {
+        "submission.c": 100,
+        "submission.py": 0,
+    }
+    assert {s["submission"]: s["final_grade"] for s in graded_with_testcase} == {
+        "submission.c": 100,
+        "submission.py": 100,
+    }
+
+
+def test_process_executor(monkeypatch):
+    with TemporaryDirectory() as tmpdir:
+        precompilations, fingerprints = Path(tmpdir) / "precompilations.txt", Path(tmpdir) / "fingerprints.txt"
+        record_calling_processes(monkeypatch, grader_module.Grader, "_precompile_testcase", precompilations)
+        record_calling_processes(monkeypatch, grader_module, "get_testcase_fingerprint", fingerprints)
+        with tools.silence_output() as buf:
+            autograder(["run", "examples/fibonacci_c", "-j", "--no-cache", "--executor", "process", "--workers", "2"])
+            real_result = int(json.loads(buf.getvalue())["average_score"])
+        precompiling_processes = precompilations.read_text().split()
+        fingerprinting_processes = fingerprints.read_text().split()
+    assert real_result == 58
+    # The testcases are only prepared once, in the parent process
+    testcase_count = len(list(Path("examples/fibonacci_c/tests/testcases").iterdir()))
+    assert precompiling_processes == fingerprinting_processes == [str(os.getpid())] * testcase_count
+
+
+def record_calling_processes(monkeypatch, owner: object, name: str, log: Path) -> None:
+    """Worker processes can only report their calls through the file system"""
+    log.touch()
+    original = getattr(owner, name)
+
+    def record() -> None:
+        with log.open("a") as f:
+            f.write(f"{os.getpid()}\n")
+
+    if inspect.iscoroutinefunction(original):
+
+        async def wrapper(*args, **kwargs):
+            record()
+            return await original(*args, **kwargs)
+
+    else:
+
+        def wrapper(*args, **kwargs):
+            record()
+            return original(*args, **kwargs)
+
+    monkeypatch.setattr(owner, name, wrapper)
+
+
+def test_parallel_testcases():
+    with TemporaryDirectory() as tmpdir:
+        test_dir = Path(tmpdir) / "fibonacci_c"
+        shutil.copytree("examples/fibonacci_c", test_dir)
+        config = test_dir / "tests" / "config.toml"
+        config.write_text(config.read_text().replace("[CONFIG]", "[CONFIG]\nPARALLEL_TESTCASES = true"))
+        with tools.silence_output() as buf:
+            autograder(["run", str(test_dir), "-j", "--no-cache"])
+            real_result = int(json.loads(buf.getvalue())["average_score"])
+    assert real_result == 58
+
+
+def test_performance():
+    with tools.silence_output() as buf:
+        autograder(["run", "examples/performance", "-j", "--no-cache"])
+        submissions = json.loads(buf.getvalue())["submissions"]
+    final_grades = {s["submission"]: s["final_grade"] for s in submissions}
+    assert final_grades == {"efficient_homework.py": 100, "inefficient_homework.py": 0, "wrong_homework.py": 0}
+
+
+def test_process_executor_measures_reference_once(monkeypatch):
+    with TemporaryDirectory() as tmpdir:
+        measurements = Path(tmpdir) / "measurements.txt"
+        record_calling_processes(monkeypatch, TestCase, "measure_reference_cpu_time", measurements)
+        with tools.silence_output() as buf:
+            autograder(["run", "examples/performance", "-j", "--no-cache", "--executor", "process", "--workers", "2"])
+            submissions = json.loads(buf.getvalue())["submissions"]
+        measuring_processes = measurements.read_text().split()
+    final_grades = {s["submission"]: s["final_grade"] for s in submissions}
+    assert final_grades == {"efficient_homework.py": 100, "inefficient_homework.py": 0, "wrong_homework.py": 0}
+    assert measuring_processes == [str(os.getpid())]
+
+
+def test_trace():
+    with TemporaryDirectory() as tmpdir:
+        trace = Path(tmpdir) / "trace.json"
+        with tools.silence_output() as buf:
+            autograder(["run", "examples/simplest_c", "-j", "--no-cache", "--trace", str(trace)])
+            summary = buf.getvalue()
+        events = json.loads(trace.read_text())["traceEvents"]
+    spans = [e for e in events if e["ph"] == "X"]
+    assert {"gather_submissions", "precompile_submission", "compile_testcase", "execute", "log"} <= {
+        e["name"] for e in spans
+    }
+    assert all("submission" in e["args"] and "testcase" in e["args"] for e in spans if e["name"] == "execute")
+    assert "precompile_submission" in summary
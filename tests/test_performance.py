@@ -0,0 +1,12 @@
+import pytest
+
+from autograder.testcase_utils.performance import PerformanceGrading
+
+
+@pytest.mark.parametrize(
+    "ratio,expected_score",
+    [(0.5, 100), (1, 100), (1.5, 75), (2, 50), (2.5, 25), (3, 0), (10, 0)],
+)
+def test_performance_curve_interpolation(ratio: float, expected_score: float):
+    grading = PerformanceGrading(runs=1, warmup_runs=0, curve=((1, 100), (2, 50), (3, 0)))
+    assert grading.get_score(ratio) == pytest.approx(expected_score)
@@ -1,9 +1,18 @@
 import json
+import shutil
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
 from typing import Set, Tuple
 
+import numpy as np
+from pytest import approx
+
+import autograder.plagiarism_detection.plagiarism_detection as plagiarism_detection
 from autograder.__main__ import main as autograder
+from autograder.plagiarism_detection.corpus import Corpus
+from autograder.plagiarism_detection.fingerprints import get_candidate_pairs
+from autograder.plagiarism_detection.token_cache import TokenCache
 
-from pytest import approx
 from . import tools
 
 
@@ -58,3 +67,288 @@ def test_fibonacci_example():
     real_results = [convert_to_comparable(r) for r in raw_real_result["results"]]
 
     assert COMPARABLE_EXPECTED_PLAGIARISM_DATA == real_results
+
+
+def test_wide_band_gives_the_same_results():
+    with tools.silence_output() as buf:
+        autograder(["plagiarism", "examples/fibonacci_c", "--band", "10000"])
+        raw_real_result = json.loads(buf.getvalue())
+
+    real_results = [convert_to_comparable(r) for r in raw_real_result["results"]]
+
+    assert COMPARABLE_EXPECTED_PLAGIARISM_DATA == real_results
+
+
+def test_single_thread_gives_the_same_results():
+    with tools.silence_output() as buf:
+        autograder(["plagiarism", "examples/fibonacci_c", "--jobs", "1"])
+        raw_real_result = json.loads(buf.getvalue())
+
+    real_results = [convert_to_comparable(r) for r in raw_real_result["results"]]
+
+    assert COMPARABLE_EXPECTED_PLAGIARISM_DATA == real_results
+
+
+def test_fingerprint_prefilter_only_aligns_overlapping_pairs():
+    with tools.silence_output() as buf:
+        autograder(["plagiarism", "examples/fibonacci_c", "--min-overlap", "0.5"])
+        raw_real_result = json.loads(buf.getvalue())
+
+    real_results = [convert_to_comparable(r) for r in raw_real_result["results"]]
+
+    assert COMPARABLE_EXPECTED_PLAGIARISM_DATA[:2] == real_results
+
+
+def test_all_languages_are_compared():
+    with TemporaryDirectory() as tmpdir:
+        for file in Path("examples/fibonacci_c").glob("*.c"):
+            shutil.copy(file, tmpdir)
+        for file in Path("examples/python").glob("*.py"):
+            shutil.copy(file, tmpdir)
+        Path(tmpdir, "notes.md").write_text("Not a submission")
+        with tools.silence_output() as buf:
+            autograder(["plagiarism", tmpdir])
+            raw_real_result = json.loads(buf.getvalue())
+
+    c_results = [convert_to_comparable(r) for r in raw_real_result["results"] if r["language"] == "c"]
+    python_results = [r for r in raw_real_result["results"] if r["language"] == "py"]
+
+    assert COMPARABLE_EXPECTED_PLAGIARISM_DATA == c_results
+    assert len(python_results) == 1
+    assert len(raw_real_result["results"]) == 7
+
+
+def test_directory_submissions_are_compared_as_a_whole():
+    with TemporaryDirectory() as tmpdir:
+        alice, bob = Path(tmpdir) / "alice", Path(tmpdir) / "bob"
+        (bob / "src").mkdir(parents=True)
+        alice.mkdir()
+        (alice / "Makefile").touch()
+        (bob / "Makefile").touch()
+        shutil.copy("examples/fibonacci_c/perfect_student_homework.c", alice / "main.c")
+        shutil.copy("examples/fibonacci_c/failing_student_homework.c", alice / "fib.c")
+        shutil.copy("examples/fibonacci_c/student_with_wrong_assignment_name.c", bob / "src" / "fib.c")
+        shutil.copy("examples/fibonacci_c/average_student_homework.c", bob / "src" / "main.c")
+        shutil.copy("examples/fibonacci_c/average_student_homework.c", Path(tmpdir) / "carol.c")
+        with tools.silence_output() as buf:
+            autograder(["plagiarism", tmpdir])
+            raw_real_result = json.loads(buf.getvalue())
+
+    results = {frozenset((r["student1"], r["student2"])): r for r in raw_real_result["results"]}
+
+    assert len(results) == 3
+    assert results[frozenset(("bob", "carol.c"))]["similarity_score"] > 0.5
+    assert results[frozenset(("bob", "carol.c"))].get("student1_file", "src/main.c") == "src/main.c"
+    assert results[frozenset(("bob", "carol.c"))].get("student2_file", "src/main.c") == "src/main.c"
+    assert {v for k, v in results[frozenset(("alice", "bob"))].items() if k.endswith("_file")} == {"fib.c", "src/fib.c"}
+
+
+def test_files_without_tokens_do_not_affect_other_pairs():
+    with TemporaryDirectory() as tmpdir:
+        for path in Path("examples/fibonacci_c").glob("*.c"):
+            shutil.copy(path, tmpdir)
+        (Path(tmpdir) / "empty.c").touch()
+        (Path(tmpdir) / "comment.c").write_text("// Nothing to see here\n")
+        with tools.silence_output() as buf:
+            autograder(["plagiarism", tmpdir])
+            all_results = [convert_to_comparable(r) for r in json.loads(buf.getvalue())["results"]]
+        with tools.silence_output() as buf:
+            autograder(["plagiarism", tmpdir, "--min-score", "0.1"])
+            passing_results = [convert_to_comparable(r) for r in json.loads(buf.getvalue())["results"]]
+
+    assert all_results[: len(COMPARABLE_EXPECTED_PLAGIARISM_DATA)] == COMPARABLE_EXPECTED_PLAGIARISM_DATA
+    assert all(score == 0 for students, score in all_results if students & {"empty.c", "comment.c"})
+    assert passing_results == COMPARABLE_EXPECTED_PLAGIARISM_DATA[:1]
+
+
+def test_candidate_pairs_find_copies():
+    rng = np.random.default_rng(0)
+    token_streams = rng.integers(0, 100, (50, 200)).astype(np.int32)
+    token_streams[7] = token_streams[3]
+    token_streams[7, ::20] = 0
+
+    assert get_candidate_pairs(list(token_streams), 0.5, 0).tolist() == [[3, 7]]
+    assert [3, 7] in get_candidate_pairs(list(token_streams), 0, 1).tolist()
+
+
+def test_abandoned_alignments_do_not_change_passing_scores():
+    rng = np.random.default_rng(0)
+    token_streams = rng.integers(0, 20, (30, 150))
+    token_streams[7] = token_streams[3]
+    token_streams[7, ::10] = 0
+    token_streams[12, 50:] = token_streams[5, 50:]
+    tokens, offsets = token_streams.ravel().astype(np.uint8), np.arange(0, token_streams.size + 1, 150)
+    matrix = plagiarism_detection.build_similarity_matrix(
+        plagiarism_detection.get_token_frequencies(np.bincount(tokens, minlength=21))
+    )
+    self_similarities = plagiarism_detection.build_self_similarities(tokens, offsets, matrix)
+    all_pairs, all_scores = plagiarism_detection.run_comparisons(tokens, offsets, matrix, self_similarities)
+
+    for min_score in (0.2, 0.4, 0.8):
+        pairs, scores = plagiarism_detection.run_comparisons(
+            tokens, offsets, matrix, self_similarities, min_score=min_score
+        )
+        assert pairs.tolist() == all_pairs[all_scores >= min_score].tolist()
+        assert scores.tolist() == all_scores[all_scores >= min_score].tolist()
+        pair_scores = plagiarism_detection.run_candidate_comparisons(
+            tokens, offsets, matrix, self_similarities, all_pairs, min_score=min_score
+        )
+        assert pair_scores[all_scores >= min_score].tolist() == all_scores[all_scores >= min_score].tolist()
+        assert (pair_scores[all_scores < min_score] < min_score).all()
+
+
+def test_tied_top_pairs_do_not_depend_on_thread_count():
+    rng = np.random.default_rng(0)
+    base = rng.integers(1, 5, 12)
+    # Only the ends of the streams are aligned so the streams that end like base are similar to it.
+    # The beginnings of each pair use distinct tokens with the same counts which makes their scores exactly equal
+    low_prefix, high_prefix = rng.integers(9, 11, 20), rng.integers(5, 7, 40)
+    token_streams = [
+        base,
+        rng.integers(13, 16, 10),
+        rng.integers(16, 18, 10),
+        rng.integers(18, 21, 10),
+        np.concatenate((low_prefix, base[6:])),
+        np.concatenate((low_prefix + 2, base[6:])),
+        np.concatenate((high_prefix, base[3:])),
+        np.concatenate((high_prefix + 2, base[3:])),
+    ]
+    tokens = np.concatenate(token_streams).astype(np.uint8)
+    offsets = np.concatenate(([0], np.cumsum([len(s) for s in token_streams])))
+    matrix = plagiarism_detection.build_similarity_matrix(
+        plagiarism_detection.get_token_frequencies(np.bincount(tokens, minlength=21))
+    )
+    self_similarities = plagiarism_detection.build_self_similarities(tokens, offsets, matrix)
+    all_pairs, all_scores = plagiarism_detection.run_comparisons(tokens, offsets, matrix, self_similarities)
+    order = np.argsort(-all_scores, kind="mergesort")
+    # (0, 4) and (0, 5) are tied at the cutoff and share a chunk with (0, 6) and (0, 7) when there is a single thread
+    assert all_pairs[order[:4]].tolist() == [[0, 6], [0, 7], [0, 4], [0, 5]]
+    assert all_scores[order[2]] == all_scores[order[3]]
+
+    for thread_count in (1, 2, 8):
+        pairs, scores = plagiarism_detection.get_all_similarities(
+            tokens, offsets, matrix, self_similarities, 0, 3, 0.0, thread_count
+        )
+        assert pairs.tolist() == all_pairs[order[:3]].tolist()
+        assert scores.tolist() == all_scores[order[:3]].tolist()
+
+
+def test_submissions_are_compared_to_corpus():
+    with TemporaryDirectory() as tmpdir:
+        corpus, new_semester = Path(tmpdir) / "corpus", Path(tmpdir) / "new_semester"
+        new_semester.mkdir()
+        shutil.copy("examples/fibonacci_c/failing_student_homework.c", new_semester / "new_student.c")
+        with tools.silence_output():
+            autograder(["plagiarism", "examples/fibonacci_c", "--corpus", str(corpus), "--add-to-corpus"])
+        with tools.silence_output() as buf:
+            autograder(["plagiarism", str(new_semester), "--corpus", str(corpus)])
+            raw_real_result = json.loads(buf.getvalue())
+
+    real_results = [convert_to_comparable(r) for r in raw_real_result["results"]]
+
+    assert len(real_results) == 4
+    assert real_results[0] == ({"new_student.c", "fibonacci_c/failing_student_homework.c"}, approx(1))
+
+
+def test_corpus_keeps_submissions_with_the_same_name_from_different_semesters(monkeypatch):
+    with TemporaryDirectory() as tmpdir:
+        corpus = Corpus(Path(tmpdir) / "corpus")
+        semesters = []
+        for semester, homework in (("fall", "failing_student_homework.c"), ("spring", "perfect_student_homework.c")):
+            (Path(tmpdir) / semester / "hw1").mkdir(parents=True)
+            semesters.append(Path(tmpdir) / semester / "hw1" / "student.c")
+            shutil.copy(Path("examples/fibonacci_c") / homework, semesters[-1])
+        plagiarism_detection.compare(semesters[:1], corpus=corpus, add_to_corpus=True)
+        # The whole corpus gets split into chunks of a single entry
+        monkeypatch.setattr(plagiarism_detection, "CORPUS_PAIRS_PER_CHUNK", 1)
+        results = plagiarism_detection.compare(semesters[1:], corpus=corpus, add_to_corpus=True)["c"]
+        # Adding the same submissions again changes nothing
+        plagiarism_detection.compare(semesters, corpus=corpus, add_to_corpus=True)
+        section = corpus.get("c")
+
+    assert list(results) == [frozenset((semesters[1], PurePosixPath("hw1/student.c")))]
+    assert 0 < next(iter(results.values())).score < 1
+    assert section.names == ["hw1/student.c", "hw1/student.c"]
+    assert len(set(section.hashes)) == 2
+    assert len(section.offsets) == 3 and section.offsets[-1] == len(section.tokens)
+
+
+def test_corpus_token_counts_match_the_local_ones():
+    with TemporaryDirectory() as tmpdir:
+        alice = Path(tmpdir) / "alice"
+        alice.mkdir()
+        (alice / "Makefile").touch()
+        shutil.copy("examples/fibonacci_c/perfect_student_homework.c", alice / "main.c")
+        shutil.copy("examples/fibonacci_c/failing_student_homework.c", alice / "fib.c")
+        shutil.copy("examples/fibonacci_c/average_student_homework.c", Path(tmpdir) / "bob.c")
+        files = [alice, Path(tmpdir) / "bob.c"]
+        corpus = Corpus(Path(tmpdir) / "corpus")
+        plagiarism_detection.compare(files, corpus=corpus, add_to_corpus=True)
+        section = corpus.get("c")
+        local_token_counts = plagiarism_detection.parse_files(plagiarism_detection.initialize_language(files)["c"])[
+            "token_counts"
+        ]
+
+    # The directory submission is joined with a separator which must not be counted as a token
+    assert plagiarism_detection.SEPARATOR_TOKEN in section.tokens
+    assert section.token_counts.tolist() == local_token_counts.tolist()
+
+
+def test_cached_files_are_not_lexed_again(monkeypatch):
+    files = sorted(Path("examples/fibonacci_c").glob("*.c"))
+    language = plagiarism_detection.initialize_language(files)["c"]
+    with TemporaryDirectory() as tmpdir:
+        cache = TokenCache(Path(tmpdir))
+        lexed = plagiarism_detection.parse_files(language, cache)
+        monkeypatch.setattr(plagiarism_detection, "tokenize_file", None)
+        cached = plagiarism_detection.parse_files(language, cache)
+
+    assert np.array_equal(lexed["tokens"], cached["tokens"])
+    assert np.array_equal(lexed["freq"], cached["freq"])
+
+
+def test_lexing_in_several_processes_gives_the_same_tokens():
+    files = sorted(Path("examples/fibonacci_c").glob("*.c"))
+    language = plagiarism_detection.initialize_language(files)["c"]
+
+    serial = plagiarism_detection.parse_files(language, jobs=1)
+    parallel = plagiarism_detection.parse_files(language, jobs=2)
+
+    assert np.array_equal(serial["tokens"], parallel["tokens"])
+    assert np.array_equal(serial["token_counts"], parallel["token_counts"])
+
+
+def test_long_files_are_not_truncated():
+    with TemporaryDirectory() as tmpdir:
+        file = Path(tmpdir) / "long.c"
+        file.write_text("int main() {\n" + "    int x = 1;\n" * 2000 + "}\n")
+        language = plagiarism_detection.initialize_language([file])["c"]
+
+        assert plagiarism_detection.parse_files(language)["lengths"][0] == 2000 * 5 + 6
+        assert plagiarism_detection.parse_files(language, max_tokens=100)["lengths"][0] == 100
+
+
+def test_only_most_similar_pairs_are_output():
+    with tools.silence_output() as buf:
+        autograder(["plagiarism", "examples/fibonacci_c", "--top", "2", "--jsonl"])
+        real_results = [convert_to_comparable(json.loads(line)) for line in buf.getvalue().splitlines()]
+
+    assert COMPARABLE_EXPECTED_PLAGIARISM_DATA[:2] == real_results
+
+
+def test_jsonl_output_has_every_pair():
+    with tools.silence_output() as buf:
+        autograder(["plagiarism", "examples/fibonacci_c", "--jsonl"])
+        real_results = [convert_to_comparable(json.loads(line)) for line in buf.getvalue().splitlines()]
+
+    assert COMPARABLE_EXPECTED_PLAGIARISM_DATA == sorted(real_results, key=lambda r: -r[1])
+
+
+def test_pairs_below_min_score_are_not_output():
+    with tools.silence_output() as buf:
+        autograder(["plagiarism", "examples/fibonacci_c", "--min-score", "0.05"])
+        raw_real_result = json.loads(buf.getvalue())
+
+    real_results = [convert_to_comparable(r) for r in raw_real_result["results"]]
+
+    assert COMPARABLE_EXPECTED_PLAGIARISM_DATA[:3] == real_results
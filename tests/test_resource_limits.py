@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from autograder.testcase_utils.resource_limits import BYTES_IN_MEGABYTE, ResourceLimits
+from autograder.testcase_utils.shell import ShellCommand, ShellError
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="setrlimit is only available on unix")
+
+python = ShellCommand(sys.executable)
+
+
+def run_until_failure(code: str, limits: ResourceLimits, **kwargs) -> ShellError:
+    with pytest.raises(ShellError) as e:
+        asyncio.run(
+            python("-c", code, timeout=10, measure_resource_usage=True, **limits.get_subprocess_kwargs(), **kwargs)
+        )
+    return e.value
+
+
+def run_until_limit_is_exceeded(code: str, limits: ResourceLimits, **kwargs) -> str:
+    error = run_until_failure(code, limits, **kwargs)
+    violation = limits.get_violation(error.returncode, error.stderr, error.resource_usage)
+    assert violation is not None
+    return violation
+
+
+def test_memory_limit():
+    limits = ResourceLimits(memory=256 * BYTES_IN_MEGABYTE)
+    assert run_until_limit_is_exceeded("bytearray(2 * 1024 ** 3)", limits) == "Exceeded memory limit of 256 MB"
+
+
+def test_memory_limit_without_an_error_message():
+    limits = ResourceLimits(memory=256 * BYTES_IN_MEGABYTE)
+    # Fills the memory up and then crashes the same way as a C program that dereferences the NULL from malloc
+    code = """
+import ctypes
+chunks = []
+try:
+    while True:
+        chunks.append(b"x" * 1024 ** 2)
+except MemoryError:
+    ctypes.string_at(0)
+"""
+    assert run_until_limit_is_exceeded(code, limits) == "Exceeded memory limit of 256 MB"
+
+
+def test_cpu_time_limit():
+    limits = ResourceLimits(cpu_time=1)
+    assert run_until_limit_is_exceeded("while True: pass", limits) == "Exceeded CPU time limit of 1 seconds"
+
+
+def test_cpu_time_hard_limit():
+    limits = ResourceLimits(cpu_time=1)
+    code = "import signal\nsignal.signal(signal.SIGXCPU, signal.SIG_IGN)\nwhile True: pass"
+    assert run_until_limit_is_exceeded(code, limits) == "Exceeded CPU time limit of 1 seconds"
+
+
+def test_crashes_are_not_reported_as_violations():
+    limits = ResourceLimits(memory=256 * BYTES_IN_MEGABYTE, cpu_time=1)
+    for code in ("import os, signal\nos.kill(os.getpid(), signal.SIGKILL)", "import ctypes\nctypes.string_at(0)"):
+        error = run_until_failure(code, limits)
+        assert limits.get_violation(error.returncode, error.stderr, error.resource_usage) is None
+
+
+def test_file_size_limit():
+    limits = ResourceLimits(file_size=1 * BYTES_IN_MEGABYTE)
+    write = "open('output.txt', 'wb').write(b'x' * 2 * 1024 ** 2)"
+    # python ignores SIGXFSZ so the write fails with an error unless the signal is restored
+    restore_signal = "import signal\nsignal.signal(signal.SIGXFSZ, signal.SIG_DFL)\n"
+    with TemporaryDirectory() as tmpdir:
+        for code in (write, restore_signal + write):
+            assert run_until_limit_is_exceeded(code, limits, cwd=tmpdir) == "Exceeded file size limit of 1 MB"
+            assert (Path(tmpdir) / "output.txt").stat().st_size == limits.file_size
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux") or os.geteuid() == 0, reason="the process limit doesn't apply to root"
+)
+def test_process_limit():
+    user_process_count = sum(1 for p in Path("/proc").glob("[0-9]*") if p.stat().st_uid == os.getuid())
+    limits = ResourceLimits(processes=user_process_count + 5)
+    # The children exit on their own shortly after the parent fails to start any more of them
+    code = """
+import os, time
+for _ in range(100):
+    if os.fork() == 0:
+        time.sleep(1)
+        os._exit(0)
+"""
+    assert run_until_limit_is_exceeded(code, limits) == f"Exceeded process limit of {limits.processes}"
+
+
+def test_process_limit_error_message():
+    limits = ResourceLimits(processes=10)
+    stderr = "BlockingIOError: [Errno 11] Resource temporarily unavailable"
+    assert limits.get_violation(1, stderr) == "Exceeded process limit of 10"
+    assert ResourceLimits().get_violation(1, stderr) is None
+
+
+def test_no_limits_by_default():
+    assert not ResourceLimits()
+    assert ResourceLimits().get_subprocess_kwargs() == {}
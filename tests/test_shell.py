@@ -0,0 +1,29 @@
+import asyncio
+import sys
+
+import pytest
+
+from autograder.testcase_utils.shell import OutputLimitExceededError, ShellCommand
+
+python = ShellCommand(sys.executable)
+
+
+def test_output_within_limit_is_captured():
+    result = asyncio.run(python("-c", "print(input() * 2)", stdin="ab", max_output_size=1000))
+    assert result.stdout == "abab\n"
+
+
+def test_infinite_output_gets_cut_off():
+    with pytest.raises(OutputLimitExceededError) as e:
+        asyncio.run(python("-c", "while True: print('spam')", max_output_size=100_000, timeout=10))
+    assert e.value.limit == 100_000
+    assert e.value.stdout.startswith("spam\n")
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="resource usage is not measured on Windows")
+def test_resource_usage_gets_measured():
+    code = "import sys; x = bytearray(100 * 1024 * 1024); sys.exit(3)"
+    result = asyncio.run(python("-c", code, allowed_exit_codes=(3,), measure_resource_usage=True))
+    assert result.returncode == 3
+    assert result.resource_usage is not None
+    assert result.resource_usage.max_memory >= 100 * 1024 * 1024